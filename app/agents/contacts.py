@@ -1,5 +1,7 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from app.guardrails import extract_contacts
+from app.contact_directory import get_contact_directory
+from app.router import route_departments
 from app.config import LOW_CONF_FALLBACK, HOSPITAL_SWITCHBOARD, HEALTHLINK_BC
 
 CONTACT_TRIGGERS = [
@@ -10,17 +12,47 @@ CONTACT_TRIGGERS = [
 class ContactsAgent:
     """
     Service Directory & Contacts Agent
-    - Deterministically extracts phone numbers / special helplines from retrieved contexts.
+    - Answers from the contact directory precomputed at index build time (no retrieval,
+      no LLM); answer_direct() is what the orchestrator tries before retrieving.
+    - Otherwise deterministically extracts phone numbers / special helplines from retrieved contexts.
     - Never invents numbers; if none found, falls back to switchboard.
     """
 
     name = "contacts"
+    retrieval = "lexical"   # phone numbers/helpline names are exact tokens: BM25 finds them
 
     def can_handle(self, query: str) -> bool:
         t = query.lower()
         return any(k in t for k in CONTACT_TRIGGERS)
 
+    def answer_direct(self, query: str) -> Optional[Dict[str, Any]]:
+        """Directory lookup only; None when the directory has nothing for the query."""
+        directory = get_contact_directory()
+        if not len(directory):
+            return None
+        depts, _ = route_departments(query)   # keyword routing: no embedding needed
+        entries = directory.lookup(query, depts=depts)
+        if not entries:
+            return None
+        lines, citations, sources = [], [], []
+        for e in entries:
+            label = f" — {e['label']}" if e["label"] else ""
+            cites = [src["source"] + (f", p. {src['page']}" if src.get("page") else "")
+                     for src in e["sources"]]
+            lines.append(f"• **{e['number']}**{label}" + (f" ({'; '.join(cites)})" if cites else ""))
+            citations.extend(c for c in cites if c not in citations)
+            sources.extend({"dept": e["dept"], **src} for src in e["sources"])
+        lines.append(f"• For general health advice in BC: **HealthLink BC at {HEALTHLINK_BC}**")
+        return {
+            "allowed": True,
+            "answer": "\n".join(lines),
+            "citations": citations,
+            "sources": sources,   # directory source refs: {source, page, dept}
+            "fallback": None
+        }
+
     def run(self, query: str, contexts: List[str]) -> Dict[str, Any]:
+        """Numbers found in the retrieved contexts (the orchestrator tries answer_direct first)."""
         phones, flags = extract_contacts(contexts)  # flags may include "310-MHSU (6478)"
         if not phones and not flags:
             # Minimal safe fallback: don't guess; offer switchboard
@@ -0,0 +1,230 @@
+import sys, pathlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterator, List, Optional
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from embeddings import preload_indexes, embed_queries, encoder_metrics
+from orchestrator import handle_query
+from app.rag_pipeline import get_engine, prefill_stats   # the instance the orchestrator uses
+
+# Run with: uvicorn app.api_server:app --host 0.0.0.0 --port 8000
+# One process holds one copy of the models; scale out with more processes/hosts
+# behind a proxy, each gated on /readyz.
+
+# Stage limits: retrieval (query encoder, FAISS, BM25, agents) and generation (LLM)
+# get their own thread pools and semaphores, so slow generations can't starve
+# cheap contact/cached answers of retrieval slots.
+EMBED_CONCURRENCY = 4
+LLM_CONCURRENCY = 2      # streams consumed at once; the LLM engine queues behind this
+REQUEST_DEADLINE_S = 60.0
+MAX_DEADLINE_S = 300.0
+MAX_BATCH = 16
+WARM_ON_STARTUP = True
+
+_END = object()
+
+_embed_pool = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY, thread_name_prefix="api-embed")
+_llm_pool = ThreadPoolExecutor(max_workers=LLM_CONCURRENCY, thread_name_prefix="api-llm")
+_embed_sem: Optional[asyncio.Semaphore] = None
+_llm_sem: Optional[asyncio.Semaphore] = None
+_warm = {"indexes": False, "embedding_model": False, "llm": False, "errors": {}}
+
+class QueryRequest(BaseModel):
+    query: str = Field(min_length=1, max_length=2000)
+    session_id: Optional[str] = None
+    timeout_s: Optional[float] = Field(default=None, gt=0)
+
+class BatchRequest(BaseModel):
+    queries: List[str] = Field(min_length=1)
+    timeout_s: Optional[float] = Field(default=None, gt=0)
+
+def _load_indexes():
+    if not preload_indexes(warm_model=False):
+        raise FileNotFoundError("no indexes built yet")
+
+def _warm_up():
+    """Load indexes, the query encoder and the LLM; /readyz reports progress."""
+    for name, fn in (("indexes", _load_indexes),
+                     ("embedding_model", lambda: embed_queries(["warm up"])),
+                     ("llm", lambda: get_engine().warm())):
+        try:
+            fn()
+            _warm[name] = True
+        except Exception as e:   # a missing index/model keeps the server not-ready
+            _warm["errors"][name] = f"{type(e).__name__}: {e}"
+
+@asynccontextmanager
+async def _lifespan(_app: FastAPI):
+    global _embed_sem, _llm_sem
+    _embed_sem = asyncio.Semaphore(EMBED_CONCURRENCY)
+    _llm_sem = asyncio.Semaphore(LLM_CONCURRENCY)
+    if WARM_ON_STARTUP:
+        # in the background: the process answers /healthz while models load
+        asyncio.get_running_loop().run_in_executor(_embed_pool, _warm_up)
+    yield
+    _embed_pool.shutdown(wait=False, cancel_futures=True)
+    _llm_pool.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(title="Royal Inland Hospital InfoBot API", lifespan=_lifespan)
+
+def _deadline(timeout_s: Optional[float]) -> float:
+    return time.monotonic() + min(timeout_s or REQUEST_DEADLINE_S, MAX_DEADLINE_S)
+
+def _remaining(deadline: float) -> float:
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise HTTPException(504, "Request deadline exceeded.")
+    return left
+
+async def _acquire(sem: asyncio.Semaphore, deadline: float, stage: str):
+    left = _remaining(deadline)
+    try:
+        await asyncio.wait_for(sem.acquire(), left)
+    except asyncio.TimeoutError:
+        raise HTTPException(503, f"Server busy ({stage} stage).", headers={"Retry-After": "2"})
+
+def _json_default(o):
+    # numpy scalars from FAISS scores / chunk ids
+    if hasattr(o, "item"):
+        return o.item()
+    raise TypeError(f"{type(o).__name__} is not JSON serializable")
+
+def _public(result: dict) -> dict:
+    out = {k: v for k, v in result.items() if k != "answer_stream"}
+    return json.loads(json.dumps(out, default=_json_default))
+
+async def _retrieve(query: str, session_id: Optional[str], deadline: float) -> dict:
+    """Stage 1: guardrails, cache, retrieval and agents (no LLM work is started)."""
+    await _acquire(_embed_sem, deadline, "retrieval")
+    try:
+        fut = asyncio.get_running_loop().run_in_executor(
+            _embed_pool, lambda: handle_query(query, stream=True, session_id=session_id))
+        try:
+            return await asyncio.wait_for(asyncio.shield(fut), _remaining(deadline))
+        except asyncio.TimeoutError:
+            raise HTTPException(504, "Request deadline exceeded during retrieval.")
+    finally:
+        _embed_sem.release()
+
+def _close_when_idle(it: Iterator[str], pending: Optional[asyncio.Future]):
+    # a generator can't be closed while a pool thread is inside next(); defer until it returns
+    if pending is None or pending.done():
+        it.close()
+    else:
+        pending.add_done_callback(lambda _: it.close())
+
+async def _generate(it: Iterator[str], deadline: float) -> AsyncIterator[str]:
+    """
+    Stage 2: pull answer pieces from the LLM stream on the LLM pool until the
+    deadline. Stopping early (deadline, client gone) closes the stream, which
+    stops generation on the engine.
+    """
+    loop = asyncio.get_running_loop()
+    pending, finished = None, False
+    try:
+        while True:
+            pending = loop.run_in_executor(_llm_pool, next, it, _END)
+            try:
+                piece = await asyncio.wait_for(asyncio.shield(pending), _remaining(deadline))
+            except asyncio.TimeoutError:
+                raise HTTPException(504, "Request deadline exceeded during generation.")
+            if piece is _END:
+                finished = True
+                return
+            yield piece
+    finally:
+        if not finished:
+            _close_when_idle(it, pending)
+
+async def _answer(query: str, session_id: Optional[str], deadline: float) -> dict:
+    result = await _retrieve(query, session_id, deadline)
+    stream = result.get("answer_stream")
+    if stream is not None:
+        await _acquire(_llm_sem, deadline, "generation")
+        try:
+            async for _ in _generate(stream, deadline):
+                pass   # the orchestrator collects the guarded answer into result
+        finally:
+            _llm_sem.release()
+    return _public(result)
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the event loop is responsive."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: indexes, query encoder and LLM are loaded (503 until they are)."""
+    ready = all(_warm[k] for k in ("indexes", "embedding_model", "llm"))
+    body = {"ready": ready, **{k: _warm[k] for k in ("indexes", "embedding_model", "llm")},
+            "errors": _warm["errors"], "llm_engine": get_engine().stats(), "prefill": prefill_stats(),
+            "encoder": encoder_metrics()}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.post("/v1/query")
+async def query(req: QueryRequest):
+    """The full orchestrator result (answer or blocked_msg, sources, timings) as JSON."""
+    return await _answer(req.query, req.session_id, _deadline(req.timeout_s))
+
+@app.post("/v1/batch")
+async def batch(req: BatchRequest):
+    """
+    Several independent questions in one call; they share the stage limits with
+    everything else. Each item is a result or {"error": {"status", "detail"}}.
+    """
+    if len(req.queries) > MAX_BATCH:
+        raise HTTPException(413, f"At most {MAX_BATCH} queries per batch.")
+    deadline = _deadline(req.timeout_s)
+
+    async def one(q: str) -> dict:
+        try:
+            return await _answer(q, None, deadline)
+        except HTTPException as e:
+            return {"error": {"status": e.status_code, "detail": e.detail}}
+
+    return {"results": await asyncio.gather(*(one(q) for q in req.queries))}
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=_json_default)}\n\n"
+
+@app.post("/v1/query/stream")
+async def query_stream(req: QueryRequest):
+    """
+    Server-sent events: "meta" (routing, sources) once retrieval is done, "delta"
+    text pieces as the answer is generated, then "done" with the final result.
+    Deadline/busy errors after the stream has started arrive as an "error" event.
+    """
+    deadline = _deadline(req.timeout_s)
+    result = await _retrieve(req.query, req.session_id, deadline)
+    stream = result.get("answer_stream")
+
+    async def events() -> AsyncIterator[str]:
+        yield _sse("meta", {k: result[k] for k in ("route_reason", "sources", "agent")})
+        if stream is not None:
+            try:
+                await _acquire(_llm_sem, deadline, "generation")
+            except HTTPException as e:
+                stream.close()
+                yield _sse("error", {"status": e.status_code, "detail": e.detail})
+                return
+            try:
+                async for piece in _generate(stream, deadline):
+                    yield _sse("delta", {"text": piece})
+            except HTTPException as e:
+                yield _sse("error", {"status": e.status_code, "detail": e.detail})
+                return
+            finally:
+                _llm_sem.release()
+        yield _sse("done", _public(result))
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
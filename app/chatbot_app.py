@@ -3,21 +3,34 @@ sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
 
 import streamlit as st
 from data_loader import load_and_chunk_by_dept
-from embeddings import build_all_indices
+from embeddings import build_all_indices, preload_indexes
 from orchestrator import handle_query
 from rag_pipeline import retrieve_with_routing, generate_answer
 from guardrails import pre_answer_guardrails, post_answer_guardrails, extract_contacts
-from config import DISCLAIMER
+from config import DISCLAIMER, ANSWER_CUT_OFF_MESSAGE
 
 st.set_page_config(page_title="RIH RAG Chatbot (Dept-Routed)", page_icon="🏥")
 st.title("🏥 Royal Inland Hospital Chatbot — Dept-Routed RAG")
 st.caption(DISCLAIMER)
 
+@st.cache_resource(show_spinner="Loading indexes…")
+def _preload():
+    # once per server process, not per rerun/session
+    return preload_indexes()
+
+_preload()
+
 with st.expander("📥 Build/Refresh Knowledge Base (per department)"):
     st.write("Place docs under `data/hospital_docs/<department>/` then build.")
+    full_rebuild = st.checkbox("Full rebuild (ignore unchanged-file cache)", value=False)
     if st.button("Build / Rebuild All Indexes"):
-        summary = build_all_indices()
-        st.success("All available department indexes rebuilt (including global).")
+        summary = build_all_indices(full=full_rebuild)
+        st.success(
+            f"Indexes updated: {len(summary['added'])} added, {len(summary['changed'])} changed, "
+            f"{len(summary['removed'])} removed, {summary['unchanged']} unchanged files."
+        )
+        if summary["errors"]:
+            st.warning(f"{len(summary['errors'])} file(s) could not be parsed and were skipped.")
         with st.expander("Build summary"):
             st.write(summary)
 
@@ -25,10 +38,20 @@ with st.expander("📥 Build/Refresh Knowledge Base (per department)"):
 query = st.text_input("Ask a hospital-related question (no personal info):")
 
 if query:
-    result = handle_query(query)
+    result = handle_query(query, stream=True)
 
     if result["blocked_msg"]:
         st.warning(result["blocked_msg"])
+    elif result.get("answer_stream") is not None:
+        st.markdown("### Answer")
+        answer_box = st.empty()
+        with answer_box.container():
+            st.write_stream(result["answer_stream"])
+        if result["blocked_msg"]:
+            # guardrail tripped mid-stream: replace the partial answer
+            answer_box.warning(result["blocked_msg"])
+        elif result.get("incomplete"):
+            st.warning(ANSWER_CUT_OFF_MESSAGE)
     elif result["answer"]:
         if result["agent"]:
             st.caption(f"Handled by agent: **{result['agent']}**")
@@ -39,8 +62,19 @@ if query:
 
     with st.expander("Routing & Sources"):
         st.write(f"**Routing**: {result['route_reason']}")
-        for i, (c, s) in enumerate(zip(result["contexts"], result["scores"]), 1):
-            st.write(f"**Chunk {i}** (score ~ {s:.2f})")
+        if result.get("timings"):
+            st.caption("Timings (ms): " + ", ".join(f"{k[:-3]} {v}" for k, v in result["timings"].items()))
+        if result.get("prompt"):
+            p = result["prompt"]
+            st.caption(f"Prompt: {p['prompt_tokens']} tokens ({p['tokens']}/{p['budget']} from "
+                       f"{p['contexts_out']} of {p['contexts_in']} contexts"
+                       + (f", {p['reused_tokens']} reused from KV cache)" if "reused_tokens" in p else ")"))
+        sources = result.get("sources") or [None] * len(result["contexts"])
+        for i, (c, s, src) in enumerate(zip(result["contexts"], result["scores"], sources), 1):
+            cite = ""
+            if src:
+                cite = f" — {src['source']}" + (f", p. {src['page']}" if src.get("page") else "")
+            st.write(f"**Chunk {i}** (score ~ {s:.2f}){cite}")
             st.write(c[:900] + ("…" if len(c) > 900 else ""))
 
 # if query:
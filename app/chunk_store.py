@@ -0,0 +1,153 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# File layout (little-endian int64 arrays, the native order on our x86/ARM hosts,
+# so they can be viewed in place without copying):
+#   header   MAGIC, n, sources_len
+#   ids      n       sorted chunk ids
+#   offsets  n + 1   byte offsets of each chunk in the text section
+#   source   n       index into the sources table
+#   start    n       character offset of the chunk in its source document
+#   page     n       1-based page (PDF form feeds), 0 = unknown
+#   sources  sources_len bytes of JSON: [[relative path, dept], ...]
+#   text     concatenated UTF-8 chunk text
+MAGIC = b"RIHCHK01"
+_HEADER = struct.Struct("<8sqq")
+
+Record = Tuple[int, str, dict]   # (chunk id, text, {"source", "dept", "start", "page"})
+
+def write_chunk_store(path: Path, records: Iterable[Record]):
+    """Write records (any order) to `path`; meta needs "source" and "dept", "start"/"page" are optional."""
+    records = sorted(records, key=lambda r: r[0])
+    sources: Dict[Tuple[str, str], int] = {}
+    ids, offsets, src, start, page, blobs = [], [0], [], [], [], []
+    for cid, text, meta in records:
+        key = (meta["source"], meta["dept"])
+        ids.append(int(cid))
+        src.append(sources.setdefault(key, len(sources)))
+        start.append(int(meta.get("start") or 0))
+        page.append(int(meta.get("page") or 0))
+        blob = text.encode("utf-8")
+        blobs.append(blob)
+        offsets.append(offsets[-1] + len(blob))
+    if len(set(ids)) != len(ids):
+        raise ValueError("duplicate chunk ids")
+    table = json.dumps([list(k) for k in sources], ensure_ascii=False).encode("utf-8")
+    n = len(ids)
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, n, len(table)))
+        for arr in (ids, offsets, src, start, page):
+            f.write(struct.pack(f"<{len(arr)}q", *arr))
+        f.write(table)
+        for blob in blobs:
+            f.write(blob)
+
+class ChunkStore:
+    """
+    Read-only, memory-mapped view of a chunk file written by write_chunk_store.
+    Opening it reads only the header and the sources table; a lookup by id is a
+    binary search over the mapped id array plus a slice of the text section, so
+    load time and resident memory don't grow with the corpus.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            if self.size < _HEADER.size:
+                raise ValueError(f"{self.path} is not a chunk store")
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, table_len = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a chunk store")
+        view = memoryview(self._mm)
+        pos = _HEADER.size
+        arrays = []
+        for length in (n, n + 1, n, n, n):
+            arrays.append(view[pos:pos + 8 * length].cast("q"))
+            pos += 8 * length
+        self._ids, self._offsets, self._src, self._start, self._page = arrays
+        self._sources = [tuple(s) for s in json.loads(bytes(view[pos:pos + table_len]))]
+        self._text_pos = pos + table_len
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _pos(self, cid: int) -> int:
+        i = bisect.bisect_left(self._ids, cid)
+        if i == len(self._ids) or self._ids[i] != cid:
+            return -1
+        return i
+
+    def __contains__(self, cid: int) -> bool:
+        return self._pos(int(cid)) >= 0
+
+    def _text_at(self, i: int) -> str:
+        a, b = self._offsets[i], self._offsets[i + 1]
+        return self._mm[self._text_pos + a:self._text_pos + b].decode("utf-8")
+
+    def _meta_at(self, i: int) -> dict:
+        source, dept = self._sources[self._src[i]]
+        return {"id": self._ids[i], "source": source, "dept": dept,
+                "start": self._start[i], "page": self._page[i] or None}
+
+    def get(self, cid: int, default: Optional[str] = None) -> Optional[str]:
+        i = self._pos(int(cid))
+        return default if i < 0 else self._text_at(i)
+
+    def __getitem__(self, cid: int) -> str:
+        i = self._pos(int(cid))
+        if i < 0:
+            raise KeyError(cid)
+        return self._text_at(i)
+
+    def meta(self, cid: int) -> Optional[dict]:
+        i = self._pos(int(cid))
+        return None if i < 0 else self._meta_at(i)
+
+    def ids(self) -> List[int]:
+        return self._ids.tolist()
+
+    def records(self) -> Iterator[Record]:
+        """Every (id, text, meta) in id order (used when rewriting a department)."""
+        for i in range(len(self._ids)):
+            yield self._ids[i], self._text_at(i), self._meta_at(i)
+
+class MultiChunkStore:
+    """Lookup across several stores with disjoint ids (e.g. 'global' over all departments)."""
+
+    def __init__(self, stores: Sequence[ChunkStore]):
+        self.stores = list(stores)
+        self.size = sum(s.size for s in self.stores)
+
+    def __len__(self) -> int:
+        return sum(len(s) for s in self.stores)
+
+    def _find(self, cid: int):
+        for s in self.stores:
+            i = s._pos(int(cid))
+            if i >= 0:
+                return s, i
+        return None, -1
+
+    def __contains__(self, cid: int) -> bool:
+        return self._find(cid)[0] is not None
+
+    def get(self, cid: int, default: Optional[str] = None) -> Optional[str]:
+        s, i = self._find(cid)
+        return default if s is None else s._text_at(i)
+
+    def __getitem__(self, cid: int) -> str:
+        s, i = self._find(cid)
+        if s is None:
+            raise KeyError(cid)
+        return s._text_at(i)
+
+    def meta(self, cid: int) -> Optional[dict]:
+        s, i = self._find(cid)
+        return None if s is None else s._meta_at(i)
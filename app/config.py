@@ -17,6 +17,16 @@ LOW_CONF_FALLBACK = (
     "Please contact the hospital information desk or check official Interior Health pages."
 )
 
+# Shown when the local LLM is saturated or times out
+LLM_BUSY_MESSAGE = (
+    "I’m answering a lot of questions right now. Please try again in a moment."
+)
+
+# Shown under a streamed answer the LLM stopped producing before it was finished
+ANSWER_CUT_OFF_MESSAGE = (
+    "This response was cut off before it was finished. Please ask again in a moment."
+)
+
 # A short disclaimer you can display in the UI
 DISCLAIMER = (
     "I provide general hospital information sourced from uploaded documents. "
@@ -0,0 +1,198 @@
+import json
+import math
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from app.guardrails import PHONE_RE, MHSU_SHORT
+from app.lexical import tokenize
+
+# Written by embeddings.build_all_indices next to the department indexes.
+CONTACTS_PATH = Path("data/indexes/contacts.json")
+DIRECTORY_VERSION = 1
+
+MHSU_NUMBER = "310-MHSU (6478)"
+MAX_LABEL_CHARS = 160
+MIN_SCORE_RATIO = 0.5   # entries scoring below this share of the best match are dropped
+MIN_LABEL_WORDS = 3   # shorter labels (e.g. "Phone:") borrow the line above, usually a heading
+
+# Words every contact question shares; they say nothing about *which* contact.
+QUERY_NOISE = frozenset("""
+call calling contact contacts number numbers phone phones line helpline hotline
+reach switchboard who need get talk speak someone telephone tel
+""".split())
+
+_SENTENCE_RE = re.compile(r"[^.!?\n]*(?:[.!?](?!\d)|\n|$)")
+_DIGITS_RE = re.compile(r"\d")
+_LABEL_JUNK_RE = re.compile(r"^[\s:;,.\-–—|()]+|[\s:;,.\-–—|(]+$")
+# "Call 250-..." / "... reach us at 250-..." read badly once the number is cut out
+_LEAD_VERB_RE = re.compile(r"^(?:please\s+)?(?:call|phone|tel|dial|contact)\b\s*", re.IGNORECASE)
+_TRAIL_WORD_RE = re.compile(r"\s*\b(?:at|on|call|phone|tel|is)\s*$", re.IGNORECASE)
+
+Entry = dict   # {"number", "kind", "label", "dept", "sources": [{"source", "page"}]}
+
+def _normalize_number(raw: str) -> str:
+    """Canonical form used for de-duplication and display: 250-374-5111."""
+    digits = "".join(_DIGITS_RE.findall(raw))
+    if len(digits) == 11 and digits[0] == "1":
+        digits = digits[1:]
+    if len(digits) == 10:
+        return f"{digits[:3]}-{digits[3:6]}-{digits[6:]}"
+    if len(digits) == 7:
+        return f"{digits[:3]}-{digits[3:]}"
+    return raw.strip()
+
+def _label_around(text: str, start: int, end: int) -> str:
+    """The sentence holding text[start:end], without the number; the line above if too short."""
+    line_start = text.rfind("\n", 0, start) + 1
+    line_end = text.find("\n", end)
+    line_end = len(text) if line_end < 0 else line_end
+    sent_start, sent_end = line_start, line_end
+    for m in _SENTENCE_RE.finditer(text, line_start, line_end):
+        if m.start() <= start < max(m.end(), m.start() + 1):
+            sent_start, sent_end = m.start(), max(m.end(), end)
+            break
+    before = _TRAIL_WORD_RE.sub("", _LABEL_JUNK_RE.sub("", text[sent_start:start]))
+    after = _LEAD_VERB_RE.sub("", _LABEL_JUNK_RE.sub("", text[end:sent_end]))
+    label = " ".join(_LEAD_VERB_RE.sub("", f"{before} {after}".strip()).split())
+    if len(label.split()) < MIN_LABEL_WORDS and line_start > 0:
+        prev_start = text.rfind("\n", 0, line_start - 1) + 1
+        heading = " ".join(text[prev_start:line_start].split())
+        if heading and not PHONE_RE.search(heading):
+            label = f"{heading.rstrip(':')}: {label}" if label else heading
+    return label[:MAX_LABEL_CHARS].strip()
+
+def extract_contacts_with_labels(text: str) -> List[Tuple[str, str, str]]:
+    """(number, kind, label) for every phone number / helpline in text, in order."""
+    found = []
+    for m in MHSU_SHORT.finditer(text):
+        end = m.end()
+        tail = re.match(r"\s*\(\s*6478\s*\)", text[end:])
+        if tail:
+            end += tail.end()
+        found.append((m.start(), MHSU_NUMBER, "helpline", _label_around(text, m.start(), end)))
+    for m in PHONE_RE.finditer(text):
+        if any(s <= m.start() < s + 20 for s, _, kind, _ in found if kind == "helpline"):
+            continue   # the "(6478)" of 310-MHSU
+        found.append((m.start(), _normalize_number(m.group()), "phone",
+                      _label_around(text, m.start(), m.end())))
+    return [(n, kind, label) for _, n, kind, label in sorted(found)]
+
+def build_dept_entries(dept: str, records: Iterable[Tuple[int, str, dict]]) -> List[Entry]:
+    """
+    Directory entries of one department from its chunk records (id, text, meta).
+    A number is listed once; its label is the longest one seen and every document
+    mentioning it is kept as a source. Overlapping chunks repeat text, which the
+    de-duplication absorbs.
+    """
+    entries: Dict[str, Entry] = {}
+    for _, text, meta in records:
+        for number, kind, label in extract_contacts_with_labels(text):
+            e = entries.get(number)
+            if e is None:
+                e = entries[number] = {"number": number, "kind": kind, "label": label,
+                                       "dept": dept, "sources": []}
+            elif len(label) > len(e["label"]):
+                e["label"] = label
+            src = {"source": meta.get("source"), "page": meta.get("page")}
+            if src not in e["sources"]:
+                e["sources"].append(src)
+    return sorted(entries.values(), key=lambda e: (e["kind"] != "helpline", e["number"]))
+
+def save_directory(path: Path, departments: Dict[str, List[Entry]]):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": DIRECTORY_VERSION, "departments": departments}, f,
+                  ensure_ascii=False, indent=1)
+
+def load_directory(path: Path = CONTACTS_PATH) -> Dict[str, List[Entry]]:
+    """{dept: entries}; empty if the file is missing or from another version."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if data.get("version") != DIRECTORY_VERSION:
+        return {}
+    return data.get("departments", {})
+
+class ContactDirectory:
+    """
+    In-memory lookup over the contact directory.
+    - Entries are indexed by the terms of their label, so a query costs one dict
+      lookup per query term, independent of corpus size.
+    - Terms are weighted by rarity across entries (idf), so "mental health" beats
+      a term every label shares.
+    """
+
+    def __init__(self, departments: Dict[str, List[Entry]]):
+        self.entries: List[Entry] = [e for d in sorted(departments) for e in departments[d]]
+        self.by_term: Dict[str, List[int]] = {}
+        self.by_dept: Dict[str, List[int]] = {}
+        for i, e in enumerate(self.entries):
+            self.by_dept.setdefault(e["dept"], []).append(i)
+            for t in set(tokenize(e["label"])) - QUERY_NOISE:
+                self.by_term.setdefault(t, []).append(i)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def lookup(self, query: str, depts: Sequence[str] = (), k: int = 3) -> List[Entry]:
+        """
+        Best entries for a contact question. Query terms found in labels decide
+        (matches weaker than MIN_SCORE_RATIO of the best are dropped); `depts`
+        (e.g. keyword-routed departments) only breaks ties and, when no term
+        matches, picks that department's helplines and numbers.
+        A number listed by several departments (e.g. the switchboard) is returned
+        once, with the sources of every listing.
+        """
+        n = len(self.entries)
+        scores: Dict[int, float] = {}
+        for t in set(tokenize(query)) - QUERY_NOISE:
+            hits = self.by_term.get(t, ())
+            if not hits:
+                continue
+            idf = math.log(1 + n / len(hits))
+            for i in hits:
+                scores[i] = scores.get(i, 0.0) + idf
+        if not scores:
+            return self._unique([i for d in depts for i in self.by_dept.get(d, ())], k)
+        boost = set(depts)
+        top = max(scores.values())
+        ranked = sorted((i for i, s in scores.items() if s >= MIN_SCORE_RATIO * top),
+                        key=lambda i: (scores[i], self.entries[i]["dept"] in boost,
+                                       self.entries[i]["kind"] == "helpline"),
+                        reverse=True)
+        return self._unique(ranked, k)
+
+    def _unique(self, ranked: Sequence[int], k: int) -> List[Entry]:
+        """The first k distinct numbers in rank order; later listings add their sources."""
+        out: Dict[str, Entry] = {}
+        for i in ranked:
+            e = self.entries[i]
+            first = out.get(e["number"])
+            if first is None:
+                if len(out) < k:
+                    out[e["number"]] = {**e, "sources": list(e["sources"])}
+                continue
+            more = [{**src, "dept": e["dept"]} for src in e["sources"]]
+            first["sources"].extend(src for src in more if src not in first["sources"])
+        return list(out.values())
+
+_directory: Optional[ContactDirectory] = None
+_directory_mtime = None
+_directory_lock = threading.Lock()
+
+def get_contact_directory(path: Path = CONTACTS_PATH) -> ContactDirectory:
+    """Process-wide directory, reloaded when a build rewrites the file."""
+    global _directory, _directory_mtime
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if _directory is None or mtime != _directory_mtime:
+        with _directory_lock:
+            if _directory is None or mtime != _directory_mtime:
+                _directory = ContactDirectory(load_directory(path) if mtime else {})
+                _directory_mtime = mtime
+    return _directory
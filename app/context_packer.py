@@ -0,0 +1,116 @@
+import re
+from typing import Callable, List, Optional, Sequence, Tuple
+from app.lexical import tokenize
+
+MIN_TEXT_OVERLAP = 20   # chars; shorter suffix/prefix matches are coincidence
+SNIP = "…"   # marks text cut out between kept sentences
+
+_SENTENCE_RE = re.compile(r"[^.!?\n]+(?:[.!?]+|\n+|$)")
+
+def approx_tokens(text: str) -> int:
+    """Fallback token count (~4 chars/token for English) when no tokenizer is loaded."""
+    return len(text) // 4 + 1
+
+def _text_overlap(a: str, b: str, max_len: int) -> int:
+    """Length of the longest suffix of a that is a prefix of b (0 if < MIN_TEXT_OVERLAP)."""
+    for n in range(min(len(a), len(b), max_len), MIN_TEXT_OVERLAP - 1, -1):
+        if a.endswith(b[:n]):
+            return n
+    return 0
+
+def collapse_overlaps(contexts: Sequence[str], sources: Optional[Sequence[Optional[dict]]] = None,
+                      max_overlap: int = 200) -> Tuple[List[str], List[int]]:
+    """
+    Merge chunks that overlap in their source document (the splitter's chunk_overlap
+    repeats text between neighbours). Uses source/start offsets when known and falls
+    back to a suffix/prefix text match. Duplicates are dropped.
+    Returns (merged texts in first-seen order, index of the first input in each).
+    """
+    sources = list(sources) if sources is not None else [None] * len(contexts)
+    merged: List[list] = []   # [text, source, start, end, first index]
+    for i, (text, src) in enumerate(zip(contexts, sources)):
+        doc, start = (src or {}).get("source"), (src or {}).get("start")
+        placed = False
+        for m in merged:
+            if text in m[0]:
+                placed = True
+            elif doc is not None and doc == m[1] and start is not None:
+                end = start + len(text)
+                if start <= m[2] <= end or m[2] <= start <= m[3]:
+                    if start < m[2]:
+                        m[0] = text[: m[2] - start] + m[0]
+                        m[2] = start
+                    if end > m[3]:
+                        m[0] = m[0] + text[m[3] - start:]
+                        m[3] = end
+                    placed = True
+            elif _text_overlap(m[0], text, max_overlap):
+                m[0] += text[_text_overlap(m[0], text, max_overlap):]
+                placed = True
+            elif _text_overlap(text, m[0], max_overlap):
+                m[0] = text + m[0][_text_overlap(text, m[0], max_overlap):]
+                placed = True
+            if placed:
+                break
+        if not placed:
+            merged.append([text, doc, start, None if start is None else start + len(text), i])
+    return [m[0] for m in merged], [m[4] for m in merged]
+
+def trim_to_budget(text: str, question: str, budget: int,
+                   count_tokens: Callable[[str], int] = approx_tokens) -> str:
+    """
+    Keep the sentences that share the most terms with the question, in document
+    order, until `budget` tokens are used. Returns "" if not even one fits.
+    """
+    sentences = [s.strip() for s in _SENTENCE_RE.findall(text) if s.strip()]
+    q_terms = set(tokenize(question))
+    ranked = sorted(range(len(sentences)),
+                    key=lambda i: len(q_terms & set(tokenize(sentences[i]))), reverse=True)
+    keep, used = set(), 0
+    for i in ranked:
+        cost = count_tokens(sentences[i]) + 1
+        if used + cost <= budget:
+            keep.add(i)
+            used += cost
+    parts, prev = [], None
+    for i in sorted(keep):
+        if prev is not None and i != prev + 1:
+            parts.append(SNIP)
+        parts.append(sentences[i])
+        prev = i
+    return " ".join(parts)
+
+def pack_contexts(question: str, contexts: Sequence[str], budget: int,
+                  sources: Optional[Sequence[Optional[dict]]] = None,
+                  count_tokens: Callable[[str], int] = approx_tokens) -> Tuple[List[str], dict]:
+    """
+    Fit retrieved contexts (best first) into `budget` tokens:
+    - overlapping/duplicate chunks are collapsed first
+    - contexts are added whole in score order while they fit
+    - a context that doesn't fit is trimmed to its most question-relevant sentences
+    Returns (packed contexts, stats) with stats = {budget, tokens, contexts_in,
+    contexts_out, collapsed, trimmed, dropped}.
+    """
+    merged, _ = collapse_overlaps(contexts, sources)
+    packed, used, trimmed, dropped = [], 0, 0, 0
+    for text in merged:
+        remaining = budget - used
+        cost = count_tokens(text)
+        if cost > remaining:
+            text = trim_to_budget(text, question, remaining, count_tokens) if remaining > 0 else ""
+            cost = count_tokens(text) if text else 0
+            if not text or cost > remaining:
+                dropped += 1
+                continue
+            trimmed += 1
+        packed.append(text)
+        used += cost
+    return packed, {
+        "budget": budget,
+        "tokens": used,
+        "contexts_in": len(contexts),
+        "contexts_out": len(packed),
+        "collapsed": len(contexts) - len(merged),
+        "trimmed": trimmed,
+        "dropped": dropped,
+    }
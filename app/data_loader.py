@@ -1,42 +1,187 @@
+import bisect
+import gzip
+import hashlib
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+import bs4
+import pdfminer
 from bs4 import BeautifulSoup
 from pdfminer.high_level import extract_text
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from slug import slug
 
 DOC_ROOT = Path("data/hospital_docs")
+SUPPORTED_SUFFIXES = {".html", ".htm", ".pdf", ".txt", ".md"}
+CHUNK_SIZE = 600
+CHUNK_OVERLAP = 80
 
-def read_html(path: Path) -> str:
+# Extracted-text cache: re-chunking/re-embedding skips PDF/HTML parsing entirely.
+# Bump the trailing number when the extraction logic below changes.
+EXTRACT_CACHE_DIR = Path("data/cache/extracted")
+EXTRACT_CACHE_ENABLED = True
+PARSER_VERSIONS = {
+    "html": f"bs4-{bs4.__version__}-1",
+    "pdf": f"pdfminer-{pdfminer.__version__}-1",
+}
+
+# Parallel ingestion
+INGEST_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+INGEST_FILE_TIMEOUT_S = 120   # a single pathological file can't stall the build longer than this
+# Parser processes start fresh instead of forking a process that already runs torch,
+# FAISS's OpenMP pool and other threads (a forked copy of a held lock deadlocks).
+INGEST_START_METHOD = "spawn"
+
+def _cached_extract(path: Path, parser: str, extract, sha256: Optional[str] = None) -> str:
+    """
+    Return extract(path), memoised on disk by (file content hash, parser version).
+    Pass `sha256` when the caller already hashed the file, so it isn't read twice.
+    """
+    if not EXTRACT_CACHE_ENABLED:
+        return extract(path)
+    key = hashlib.sha256(f"{sha256 or file_sha256(path)}:{PARSER_VERSIONS[parser]}".encode()).hexdigest()
+    blob = EXTRACT_CACHE_DIR / key[:2] / f"{key}.txt.gz"
+    try:
+        with gzip.open(blob, "rt", encoding="utf-8") as f:
+            return f.read()
+    except (OSError, EOFError):
+        pass  # missing or truncated entry: extract again
+    text = extract(path)
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    tmp = blob.with_name(f"{blob.name}.{os.getpid()}.tmp")  # parser workers may race on a key
+    with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as f:
+        f.write(text)
+    os.replace(tmp, blob)
+    return text
+
+def _extract_html(path: Path) -> str:
     html = path.read_text(encoding="utf-8", errors="ignore")
     soup = BeautifulSoup(html, "html.parser")
     return soup.get_text(separator=" ", strip=True)
 
-def read_pdf(path: Path) -> str:
+def _extract_pdf(path: Path) -> str:
     return extract_text(str(path)) or ""
 
-def load_raw_texts_by_dept(root: Path = DOC_ROOT) -> Dict[str, List[str]]:
+def read_html(path: Path, sha256: Optional[str] = None) -> str:
+    return _cached_extract(path, "html", _extract_html, sha256)
+
+def read_pdf(path: Path, sha256: Optional[str] = None) -> str:
+    return _cached_extract(path, "pdf", _extract_pdf, sha256)
+
+def read_document(path: Path, sha256: Optional[str] = None) -> str:
+    suffix = path.suffix.lower()
+    if suffix in {".html", ".htm"}:
+        return read_html(path, sha256)
+    if suffix == ".pdf":
+        return read_pdf(path, sha256)
+    return path.read_text(encoding="utf-8", errors="ignore")
+
+def iter_doc_files(root: Path = DOC_ROOT) -> Iterator[Tuple[str, Path]]:
+    """Yield (dept_slug, path) for every supported file under data/hospital_docs/<dept>/."""
+    for dept_dir in sorted(root.iterdir()):
+        if not dept_dir.is_dir():
+            continue
+        for p in sorted(dept_dir.glob("*")):
+            if p.is_file() and p.suffix.lower() in SUPPORTED_SUFFIXES:
+                yield slug(dept_dir.name), p  #normalize folder name
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class _FileTimeout(Exception):
+    pass
+
+def _on_alarm(signum, frame):
+    raise _FileTimeout()
+
+def _read_document_task(dept: str, path: Path, timeout: Optional[float],
+                        sha256: Optional[str] = None):
+    """Parse one file. Never raises: errors and timeouts come back as the 4th element."""
+    use_alarm = bool(timeout) and hasattr(signal, "SIGALRM") \
+        and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _on_alarm)
+        signal.alarm(max(1, int(timeout)))
+    try:
+        return dept, path, read_document(path, sha256), None
+    except _FileTimeout:
+        return dept, path, None, f"timed out after {timeout:.0f}s"
+    except Exception as e:
+        return dept, path, None, f"{type(e).__name__}: {e}"
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, previous)
+
+def iter_texts_parallel(
+    files: Iterable[Tuple[str, Path]],
+    workers: int = INGEST_WORKERS,
+    timeout: Optional[float] = INGEST_FILE_TIMEOUT_S,
+    hashes: Optional[Dict[Path, str]] = None,
+) -> Iterator[Tuple[str, Path, Optional[str], Optional[str]]]:
+    """
+    Parse files in a process pool and yield (dept, path, text, error) as each one finishes.
+    - text is None and error is set when a file fails or exceeds `timeout`.
+    - `hashes` ({path: sha256} the caller already computed) key the extracted-text cache.
+    - If a worker dies (e.g. a parser crash) every in-flight file fails with it; those
+      files are retried one at a time in a fresh process, so only the culprit is lost.
+    - Even a single file (the usual incremental rebuild) goes through the pool. Only
+      workers <= 1 parses in this process, without crash isolation, and then only if
+      `timeout` is unset or can be enforced: SIGALRM works on the main thread alone,
+      and Streamlit runs scripts off it.
+    """
+    files = list(files)
+    hashes = hashes or {}
+    if not files:
+        return
+    if workers <= 1 and (not timeout or threading.current_thread() is threading.main_thread()):
+        for dept, p in files:
+            yield _read_document_task(dept, p, timeout, hashes.get(p))
+        return
+
+    ctx = multiprocessing.get_context(INGEST_START_METHOD)
+    retry = []
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(files))), mp_context=ctx) as pool:
+        futs = {pool.submit(_read_document_task, d, p, timeout, hashes.get(p)): (d, p)
+                for d, p in files}
+        for fut in as_completed(futs):
+            try:
+                yield fut.result()
+            except BrokenProcessPool:
+                retry.append(futs[fut])
+
+    for dept, p in retry:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            try:
+                yield pool.submit(_read_document_task, dept, p, timeout, hashes.get(p)).result()
+            except BrokenProcessPool:
+                yield dept, p, None, "parser process crashed"
+
+def load_raw_texts_by_dept(root: Path = DOC_ROOT, workers: int = INGEST_WORKERS) -> Dict[str, List[str]]:
     """
     Returns {dept: [doc_texts...]} for each subfolder under data/hospital_docs.
-    Folders without supported files are skipped.
+    Folders without supported files are skipped, as are files that fail to parse.
     """
+    parsed = {}
+    for dept, p, text, err in iter_texts_parallel(iter_doc_files(root), workers=workers):
+        if err is None:
+            parsed[p] = (dept, text)
     data: Dict[str, List[str]] = {}
-    for dept_dir in sorted(root.iterdir()):
-        if not dept_dir.is_dir():
-            continue
-        texts: List[str] = []
-        for p in dept_dir.glob("*"):
-            if p.suffix.lower() in {".html", ".htm"}:
-                texts.append(read_html(p))
-            elif p.suffix.lower() == ".pdf":
-                texts.append(read_pdf(p))
-            elif p.suffix.lower() in {".txt", ".md"}:
-                texts.append(p.read_text(encoding="utf-8", errors="ignore"))
-        if texts:
-            data[slug(dept_dir.name)] = texts  #normalize folder name
+    for p in sorted(parsed):
+        dept, text = parsed[p]
+        data.setdefault(dept, []).append(text)
     return data
 
-def chunk_texts(texts: List[str], chunk_size=600, chunk_overlap=80) -> List[str]:
+def chunk_texts(texts: List[str], chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP) -> List[str]:
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size, chunk_overlap=chunk_overlap
     )
@@ -45,6 +190,27 @@ def chunk_texts(texts: List[str], chunk_size=600, chunk_overlap=80) -> List[str]
         chunks.extend(splitter.split_text(t))
     return chunks
 
+def chunk_text_spans(text: str, chunk_size=CHUNK_SIZE,
+                     chunk_overlap=CHUNK_OVERLAP) -> List[Tuple[str, int, Optional[int]]]:
+    """
+    Chunk one document, keeping where each chunk came from:
+    (chunk, character offset in the text, 1-based page or None).
+    Pages are counted from the form feeds pdfminer puts between PDF pages.
+    """
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
+    )
+    breaks, i = [], text.find("\f")
+    while i >= 0:
+        breaks.append(i)
+        i = text.find("\f", i + 1)
+    spans = []
+    for doc in splitter.create_documents([text]):
+        start = max(doc.metadata.get("start_index", 0), 0)
+        page = bisect.bisect_right(breaks, start) + 1 if breaks else None
+        spans.append((doc.page_content, start, page))
+    return spans
+
 def load_and_chunk_by_dept() -> Dict[str, List[str]]:
     raw = load_raw_texts_by_dept()
     return {dept: chunk_texts(texts) for dept, texts in raw.items()}
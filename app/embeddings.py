@@ -1,62 +1,936 @@
+import json
 import os
-import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
 from sentence_transformers import SentenceTransformer
 import faiss
-from data_loader import load_and_chunk_by_dept
+from data_loader import (
+    DOC_ROOT, CHUNK_SIZE, CHUNK_OVERLAP, INGEST_WORKERS,
+    iter_doc_files, iter_texts_parallel, chunk_text_spans, file_sha256,
+)
+from chunk_store import ChunkStore, MultiChunkStore, write_chunk_store
+from lexical import BM25Index
+from contact_directory import CONTACTS_PATH, build_dept_entries, load_directory, save_directory
 from slug import slug
+from query_cache import TTLCache, normalize_query
+from micro_batcher import MicroBatcher
 
 EMB_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Encoder runtime: "torch" (PyTorch fp32), "onnx" (ONNX Runtime) or "openvino";
+# the non-torch backends need sentence-transformers[onnx] / [openvino].
+# EMB_MODEL_FILE picks a file inside the model dir, e.g. the int8 export
+# "onnx/model_qint8_avx512_vnni.onnx"; EMB_MODEL_PATH is a local export dir
+# (see export_encoder) used instead of downloading EMB_MODEL_NAME.
+# Check a backend with encoder_parity_report() before switching: vectors from
+# another backend force a full rebuild (the manifest records the encoder).
+EMB_BACKEND = "torch"
+EMB_MODEL_FILE = None
+EMB_MODEL_PATH = None
 INDEX_DIR = Path("data/indexes")
 INDEX_DIR.mkdir(parents=True, exist_ok=True)
+GENERATION_PATH = INDEX_DIR / "GENERATION"
+MANIFEST_PATH = INDEX_DIR / "manifest.json"
+MANIFEST_VERSION = 3   # 2: chunk stores instead of pickles; 3: BM25 index per department
+CENTROIDS_PATH = INDEX_DIR / "dept_centroids.npz"   # for semantic routing
+EMBED_BATCH_SIZE = 256   # chunks per encode call while ingestion is still running
+
+# Resident cache limits (shared by every session/rerun in this process)
+INDEX_CACHE_MAX_ENTRIES = 16
+INDEX_CACHE_MAX_BYTES = 1_000_000_000
+
+# Map index files read-only instead of copying them into each process's heap, so
+# several app/API worker processes share one page-cached copy. Mapped indexes don't
+# count towards INDEX_CACHE_MAX_BYTES. Falls back to a normal read if FAISS can't map.
+INDEX_MMAP = True
+
+# Normalized query -> embedding (repeat FAQ questions skip the encoder)
+QUERY_EMB_CACHE_SIZE = 4096
+
+# Concurrent query encodes are coalesced into one model call: a batch goes out when
+# ENCODE_MAX_BATCH texts are waiting or the oldest has waited ENCODE_MAX_WAIT_MS.
+# Calls with ENCODE_MAX_BATCH texts or more (index builds) run directly.
+ENCODE_MAX_BATCH = 32
+ENCODE_MAX_WAIT_MS = 3.0
+
+# Departments are searched concurrently; FAISS releases the GIL during search
+SEARCH_THREADS = 4
+
+# Index structure per department: "flat" (exact), "hnsw", "ivf_flat" or "ivf_pq".
+# Departments not listed in INDEX_TYPES pick one by size (see _auto_index_type).
+INDEX_TYPES: Dict[str, str] = {}          # e.g. {"global": "hnsw"}
+FLAT_MAX_VECTORS = 20_000                 # exact search is fast enough below this
+HNSW_MAX_VECTORS = 1_000_000              # above this HNSW memory/build time gets heavy -> ivf_pq
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+IVF_MIN_POINTS_PER_LIST = 39              # FAISS k-means wants ~39 training points per centroid
+PQ_DIMS_PER_CODE = 8                      # ivf_pq: one 8-bit code per 8 dimensions (48 bytes @ 384d)
+
+# Vector codec inside the index per department: "fp32" (exact), "fp16" (2 bytes/dim),
+# "sq8" (1 byte/dim) or "pq" (1 byte per PQ_DIMS_PER_CODE dims). Lossy codecs over-fetch
+# RESCORE_FACTOR x k candidates and re-score them exactly from the float32 vectors
+# (<dept>.vecs.npy), which are memory-mapped, so they stay on disk/page cache.
+# "ivf_pq" indexes are PQ already; their codec setting is ignored.
+VECTOR_CODECS: Dict[str, str] = {}        # e.g. {"global": "sq8"}
+DEFAULT_VECTOR_CODEC = "fp32"
+PQ_MIN_VECTORS = 256 * IVF_MIN_POINTS_PER_LIST   # PQ codebooks need this many training points
+RESCORE_FACTOR = 4
+
+# Search-time knobs (change at runtime with set_search_params)
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+
+_model = None
+_model_lock = threading.Lock()
+_index_cache: "OrderedDict[str, dict]" = OrderedDict()
+_index_cache_lock = threading.Lock()
+_search_pool = None
+_query_emb_cache = TTLCache(max_entries=QUERY_EMB_CACHE_SIZE)
+_encoder = None
+_encoder_lock = threading.Lock()
+_centroids = None  # (file signature, dept slugs, unit-norm centroid matrix)
+_lexical_cache: "OrderedDict[str, tuple]" = OrderedDict()   # slug -> (file signature, BM25Index)
+_exact_cache: Dict[str, tuple] = {}   # slug -> (file signature, ExactVectors) for re-scoring
 
 def _index_paths(dept: str) -> Tuple[Path, Path]:
+    # 'global' has no chunk store of its own: its ids resolve through the department stores
+    d = slug(dept)
+    return INDEX_DIR / f"{d}.faiss", INDEX_DIR / f"{d}.chunks"
+
+def _vector_paths(dept: str) -> Tuple[Path, Path]:
     d = slug(dept)
-    return INDEX_DIR / f"{d}.faiss", INDEX_DIR / f"{d}.chunks.pkl"
-
-def build_all_indices():
-    model = SentenceTransformer(EMB_MODEL_NAME)
-    per_dept_chunks = load_and_chunk_by_dept()
-
-    # GLOBAL = union
-    all_chunks: List[str] = []
-    for ch in per_dept_chunks.values():
-        all_chunks.extend(ch)
-    per_dept_chunks = {"global": all_chunks, **per_dept_chunks}
-
-    summary = {}
-    for dept_raw, chunks in per_dept_chunks.items():
-        dept = slug(dept_raw)
-        if not chunks:
-            summary[dept] = {"chunks": 0, "built": False}
+    return INDEX_DIR / f"{d}.vecs.npy", INDEX_DIR / f"{d}.ids.npy"
+
+def _lexical_path(dept: str) -> Path:
+    return INDEX_DIR / f"{slug(dept)}.bm25"
+
+def _load_encoder(backend: str = "torch", model_file: str = None,
+                  model_path: str = None) -> SentenceTransformer:
+    kwargs = {}
+    if backend != "torch":
+        kwargs["backend"] = backend
+        if model_file:
+            kwargs["model_kwargs"] = {"file_name": model_file}
+    return SentenceTransformer(model_path or EMB_MODEL_NAME, **kwargs)
+
+def get_model() -> SentenceTransformer:
+    """Load the sentence encoder (EMB_BACKEND) once per process and reuse it."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = _load_encoder(EMB_BACKEND, EMB_MODEL_FILE, EMB_MODEL_PATH)
+    return _model
+
+def index_generation() -> int:
+    """Stamp bumped by every build; 0 if indexes were never built."""
+    try:
+        return int(GENERATION_PATH.read_text().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def _bump_generation() -> int:
+    gen = time.time_ns()
+    tmp = GENERATION_PATH.with_suffix(".tmp")
+    tmp.write_text(str(gen))
+    os.replace(tmp, GENERATION_PATH)
+    return gen
+
+def clear_index_cache():
+    with _index_cache_lock:
+        _index_cache.clear()
+        _lexical_cache.clear()
+        _exact_cache.clear()
+    _query_emb_cache.clear()
+
+def _atomic_write(path: Path, write_fn):
+    """Write to a temp file and swap it in, so concurrent readers never see a partial file."""
+    tmp = path.with_name(path.name + ".tmp")
+    write_fn(tmp)
+    os.replace(tmp, path)
+
+def _save_npy(path: Path, arr: np.ndarray):
+    def write(tmp):
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+    _atomic_write(path, write)
+
+
+def _manifest_settings() -> dict:
+    # any change here invalidates every stored vector and forces a full rebuild
+    return {"version": MANIFEST_VERSION,
+            "model": str(EMB_MODEL_PATH) if EMB_MODEL_PATH else EMB_MODEL_NAME,
+            "encoder": f"{EMB_BACKEND}:{EMB_MODEL_FILE or 'default'}",
+            "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+
+def _load_manifest():
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return manifest if manifest.get("settings") == _manifest_settings() else None
+
+def _save_manifest(manifest: dict):
+    def write(tmp):
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+    _atomic_write(MANIFEST_PATH, write)
+
+def _encode(texts: List[str]) -> np.ndarray:
+    emb = get_model().encode(texts, convert_to_numpy=True,
+                             show_progress_bar=len(texts) >= EMBED_BATCH_SIZE)
+    emb = np.ascontiguousarray(emb, dtype="float32").reshape(len(texts), -1)
+    faiss.normalize_L2(emb)
+    return emb
+
+def get_encoder() -> MicroBatcher:
+    """The process-wide batching front of the encoder (all encode calls go through it)."""
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                _encoder = MicroBatcher(_encode, max_batch=ENCODE_MAX_BATCH,
+                                        max_wait_ms=ENCODE_MAX_WAIT_MS, name="encode-batcher")
+    return _encoder
+
+def encoder_metrics() -> dict:
+    """Batch sizes, queue wait and throughput of the encoder (for sizing CPU nodes)."""
+    return get_encoder().metrics()
+
+def _encode_chunks(chunks: List[str]) -> np.ndarray:
+    return get_encoder().submit(chunks)
+
+def _empty_dept_data():
+    dim = get_model().get_sentence_embedding_dimension()
+    return np.zeros((0, dim), dtype="float32"), np.zeros(0, dtype="int64"), []
+
+def _load_dept_data(dept: str):
+    """(vectors, ids, [(id, chunk, meta)]) for a department; empty if it was never built."""
+    vec_path, ids_path = _vector_paths(dept)
+    _, ch_path = _index_paths(dept)
+    if not (vec_path.exists() and ids_path.exists() and ch_path.exists()):
+        return _empty_dept_data()
+    return np.load(vec_path), np.load(ids_path), list(ChunkStore(ch_path).records())
+
+def _auto_index_type(n: int) -> str:
+    if n <= FLAT_MAX_VECTORS:
+        return "flat"
+    return "hnsw" if n <= HNSW_MAX_VECTORS else "ivf_pq"
+
+def _codec_string(codec: str, n: int, dim: int) -> str:
+    """FAISS code part for a vector codec; PQ falls back to SQ8 on too few vectors."""
+    if codec == "pq":
+        if n < PQ_MIN_VECTORS:
+            return "SQ8"
+        m = max(c for c in range(1, dim // PQ_DIMS_PER_CODE + 1) if dim % c == 0)
+        return f"PQ{m}"
+    codes = {"fp32": "Flat", "fp16": "SQfp16", "sq8": "SQ8"}
+    if codec not in codes:
+        raise ValueError(f"Unknown vector codec '{codec}'")
+    return codes[codec]
+
+def _index_factory_string(kind: str, n: int, dim: int, codec: str = "fp32") -> str:
+    """
+    FAISS factory string for `kind` storing vectors with `codec` at this corpus size.
+    IVF types fall back to something trainable when there are too few vectors.
+    """
+    code = _codec_string(codec, n, dim)
+    if kind == "hnsw":
+        return f"IDMap,HNSW{HNSW_M}" if code == "Flat" else f"IDMap,HNSW{HNSW_M}_{code}"
+    if kind in ("ivf_flat", "ivf_pq"):
+        nlist = min(int(4 * n ** 0.5), n // IVF_MIN_POINTS_PER_LIST)
+        if nlist < 2:
+            return f"IDMap,{code}"
+        if kind == "ivf_pq" and n >= PQ_MIN_VECTORS:
+            return f"IDMap,IVF{nlist},{_codec_string('pq', n, dim)}"
+        return f"IDMap,IVF{nlist},{code}"
+    if kind != "flat":
+        raise ValueError(f"Unknown index type '{kind}'")
+    return f"IDMap,{code}"
+
+def _index_spec(dept: str, n: int, dim: int) -> str:
+    kind = INDEX_TYPES.get(slug(dept)) or _auto_index_type(n)
+    codec = VECTOR_CODECS.get(slug(dept), DEFAULT_VECTOR_CODEC)
+    return _index_factory_string(kind, n, dim, codec)
+
+def _build_index(spec: str, vecs: np.ndarray, ids: np.ndarray):
+    index = faiss.index_factory(vecs.shape[1], spec, faiss.METRIC_INNER_PRODUCT)
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        index.train(vecs)
+    index.add_with_ids(vecs, ids)
+    _apply_search_params(index)
+    return index
+
+def _apply_search_params(index, ef_search: int = None, nprobe: int = None):
+    """Set efSearch / nprobe (default: module settings) on an index, if its structure has them."""
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    ps = faiss.ParameterSpace()
+    if isinstance(inner, faiss.IndexHNSW):
+        ps.set_index_parameter(index, "efSearch", ef_search or HNSW_EF_SEARCH)
+    elif faiss.try_extract_index_ivf(inner) is not None:
+        ps.set_index_parameter(index, "nprobe", nprobe or IVF_NPROBE)
+
+def set_search_params(ef_search: int = None, nprobe: int = None):
+    """Change HNSW efSearch / IVF nprobe for loaded and future indexes."""
+    global HNSW_EF_SEARCH, IVF_NPROBE
+    if ef_search is not None:
+        HNSW_EF_SEARCH = int(ef_search)
+    if nprobe is not None:
+        IVF_NPROBE = int(nprobe)
+    with _index_cache_lock:
+        for entry in _index_cache.values():
+            _apply_search_params(entry["index"])
+
+def _write_index(dept: str, vecs: np.ndarray, ids: np.ndarray) -> str:
+    spec = _index_spec(dept, len(ids), vecs.shape[1])
+    index = _build_index(spec, vecs, ids)
+    idx_path, _ = _index_paths(dept)
+    _atomic_write(idx_path, lambda tmp: faiss.write_index(index, str(tmp)))
+    return spec
+
+def _write_dept(dept: str, vecs: np.ndarray, ids: np.ndarray, records=None) -> str:
+    """
+    Write a department's vectors, chunk store + BM25 index (if records are given)
+    and FAISS index; returns the index factory string.
+    """
+    # vectors + ids are the source of truth; the FAISS index is derived from them
+    _, ch_path = _index_paths(dept)
+    vec_path, ids_path = _vector_paths(dept)
+    _save_npy(vec_path, vecs)
+    _save_npy(ids_path, ids)
+    if records is not None:
+        _atomic_write(ch_path, lambda tmp: write_chunk_store(tmp, records))
+        lexical = BM25Index.build((cid, text) for cid, text, _ in records)
+        _atomic_write(_lexical_path(dept), lexical.save)
+    return _write_index(dept, vecs, ids)
+
+def _remove_dept(dept: str):
+    for p in (*_index_paths(dept), *_vector_paths(dept), _lexical_path(dept)):
+        p.unlink(missing_ok=True)
+    (INDEX_DIR / f"{slug(dept)}.chunks.pkl").unlink(missing_ok=True)  # pre-v2 layout
+
+def _write_centroids(depts: List[str], dept_vecs: List[np.ndarray]):
+    cents = np.ascontiguousarray(np.vstack([v.mean(axis=0) for v in dept_vecs]), dtype="float32")
+    faiss.normalize_L2(cents)
+
+    def write(tmp):
+        with open(tmp, "wb") as f:
+            np.savez(f, depts=np.array(depts), vecs=cents)
+    _atomic_write(CENTROIDS_PATH, write)
+
+def build_all_indices(full: bool = False, workers: int = INGEST_WORKERS):
+    """
+    Incrementally (re)build department indexes plus 'global'.
+    Files are tracked in manifest.json by content hash; only added or changed files
+    are parsed and embedded, and vectors of changed/deleted files are dropped.
+    full=True ignores the manifest and re-embeds everything.
+    Parsing runs in `workers` processes and overlaps with chunking and embedding;
+    files that fail to parse are reported under "errors" and retried next build.
+    Each department gets the index type from INDEX_TYPES or its size (flat/HNSW/IVF);
+    the chosen FAISS factory strings are returned under "indexes".
+    Phone numbers and helplines of each rebuilt department are extracted into the
+    contact directory (CONTACTS_PATH) for the contacts agent.
+    """
+    t_start = time.perf_counter()
+    timings = {}
+    manifest = None if full else _load_manifest()
+    old_files = manifest["files"] if manifest else {}
+    next_id = manifest["next_id"] if manifest else 0
+
+    # 1) Hash sources
+    t = time.perf_counter()
+    current = {}
+    for dept, p in iter_doc_files():
+        rel = p.relative_to(DOC_ROOT).as_posix()
+        current[rel] = {"dept": dept, "sha256": file_sha256(p), "path": p}
+    timings["hash_s"] = time.perf_counter() - t
+
+    added = [r for r in current if r not in old_files]
+    changed = [
+        r for r in current if r in old_files
+        and (old_files[r]["sha256"], old_files[r]["dept"]) != (current[r]["sha256"], current[r]["dept"])
+    ]
+    removed = [r for r in old_files if r not in current]
+    files = {r: old_files[r] for r in current if r in old_files and r not in changed}
+
+    # 2+3) Parse (process pool) -> chunk -> embed in batches, as files complete.
+    # Every chunk gets a stable id.
+    t = time.perf_counter()
+    new_chunks: List[str] = []
+    new_meta: List[dict] = []
+    new_ids: List[int] = []
+    new_depts: List[str] = []
+    vec_parts: List[np.ndarray] = []
+    errors: Dict[str, str] = {}
+    embedded = 0
+    embed_s = 0.0
+    to_parse = [(current[r]["dept"], current[r]["path"]) for r in added + changed]
+    hashes = {current[r]["path"]: current[r]["sha256"] for r in added + changed}
+    for dept, path, text, err in iter_texts_parallel(to_parse, workers=workers, hashes=hashes):
+        r = path.relative_to(DOC_ROOT).as_posix()
+        if err is not None:
+            errors[r] = err
             continue
-        emb = model.encode(chunks, convert_to_numpy=True, show_progress_bar=True)
-        faiss.normalize_L2(emb)
-        index = faiss.IndexFlatIP(emb.shape[1])
-        index.add(emb)
+        spans = chunk_text_spans(text)
+        ids = list(range(next_id, next_id + len(spans)))
+        next_id += len(spans)
+        files[r] = {"dept": dept, "sha256": current[r]["sha256"], "ids": ids}
+        new_chunks.extend(c for c, _, _ in spans)
+        new_meta.extend({"source": r, "dept": dept, "start": st, "page": pg} for _, st, pg in spans)
+        new_ids.extend(ids)
+        new_depts.extend([dept] * len(spans))
+        if len(new_chunks) - embedded >= EMBED_BATCH_SIZE:
+            te = time.perf_counter()
+            vec_parts.append(_encode_chunks(new_chunks[embedded:]))
+            embed_s += time.perf_counter() - te
+            embedded = len(new_chunks)
+    if len(new_chunks) > embedded:
+        te = time.perf_counter()
+        vec_parts.append(_encode_chunks(new_chunks[embedded:]))
+        embed_s += time.perf_counter() - te
+    new_vecs = np.vstack(vec_parts) if vec_parts else None
+    timings["ingest_s"] = time.perf_counter() - t
+    timings["embed_s"] = embed_s
+
+    # a changed file that failed to parse keeps its previous version for now
+    for r in changed:
+        if r in errors:
+            files[r] = old_files[r]
+    changed_ok = [r for r in changed if r not in errors]
+
+    # 4) Update affected departments, then re-stack global from the department vectors
+    t = time.perf_counter()
+    # stored rows are kept only if a file in the new manifest still owns them; this
+    # also drops rows a failed earlier build wrote under ids that were handed out again
+    new_id_set = set(new_ids)
+    owned = np.fromiter((i for f in files.values() for i in f["ids"] if i not in new_id_set),
+                        dtype="int64")
+    affected = {old_files[r]["dept"] for r in changed_ok + removed}
+    affected |= {files[r]["dept"] for r in added + changed_ok if r in files}
+    if manifest is None:
+        affected |= {p.name[: -len(".faiss")] for p in INDEX_DIR.glob("*.faiss")} - {"global"}
+        for p in INDEX_DIR.glob("*.chunks.pkl"):  # pre-v2 layout
+            p.unlink()
+    live_depts = sorted({f["dept"] for f in files.values() if f["ids"]})
+    index_specs: Dict[str, str] = dict(manifest.get("indexes", {})) if manifest else {}
+    contacts = load_directory(CONTACTS_PATH) if manifest else {}
+
+    for dept in sorted(affected):
+        # without a manifest, stored vectors can't be trusted: start from scratch
+        vecs, ids, records = _load_dept_data(dept) if manifest else _empty_dept_data()
+        keep = np.isin(ids, owned)
+        vecs, ids = vecs[keep], ids[keep]
+        kept = set(ids.tolist())
+        records = [rec for rec in records if rec[0] in kept]
+        sel = [j for j, d in enumerate(new_depts) if d == dept]
+        if sel:
+            vecs = np.vstack([vecs, new_vecs[sel]])
+            ids = np.concatenate([ids, np.asarray([new_ids[j] for j in sel], dtype="int64")])
+            records.extend((new_ids[j], new_chunks[j], new_meta[j]) for j in sel)
+        if len(ids):
+            index_specs[dept] = _write_dept(dept, vecs, ids, records)
+            contacts[dept] = build_dept_entries(dept, records)
+        else:
+            _remove_dept(dept)
+            index_specs.pop(dept, None)
+            contacts.pop(dept, None)
+
+    rebuild_global = bool(affected) or manifest is None
+    if rebuild_global:
+        if live_depts:
+            parts = [tuple(np.load(p) for p in _vector_paths(d)) for d in live_depts]
+            index_specs["global"] = _write_dept(
+                "global", np.vstack([v for v, _ in parts]), np.concatenate([i for _, i in parts]))
+            _write_centroids(live_depts, [v for v, _ in parts])
+            merged = BM25Index.merge([BM25Index.load(_lexical_path(d)) for d in live_depts])
+            _atomic_write(_lexical_path("global"), merged.save)
+        else:
+            _remove_dept("global")
+            index_specs.pop("global", None)
+            CENTROIDS_PATH.unlink(missing_ok=True)
+
+    # Untouched departments whose index type no longer matches INDEX_TYPES / size
+    # thresholds are re-indexed from their stored vectors (no re-embedding).
+    reindexed = []
+    for dept in live_depts + (["global"] if live_depts else []):
+        if dept in affected or (dept == "global" and rebuild_global):
+            continue
+        vec_path, ids_path = _vector_paths(dept)
+        ids = np.load(ids_path)
+        vecs = np.load(vec_path, mmap_mode="r")
+        if index_specs.get(dept) != _index_spec(dept, len(ids), vecs.shape[1]):
+            index_specs[dept] = _write_index(dept, np.ascontiguousarray(vecs), ids)
+            reindexed.append(dept)
+    timings["index_s"] = time.perf_counter() - t
+
+    # departments built before the directory existed are filled in from their chunk stores
+    missing = [d for d in live_depts if d not in contacts]
+    for dept in missing:
+        contacts[dept] = build_dept_entries(dept, ChunkStore(_index_paths(dept)[1]).records())
+    if affected or missing or not CONTACTS_PATH.exists():
+        contacts = {d: contacts[d] for d in live_depts if d in contacts}
+        _atomic_write(CONTACTS_PATH, lambda tmp: save_directory(tmp, contacts))
+
+    _save_manifest({"settings": _manifest_settings(), "next_id": next_id,
+                    "indexes": index_specs, "files": files})
+    if rebuild_global or reindexed:
+        _bump_generation()
+        clear_index_cache()
+    timings["total_s"] = time.perf_counter() - t_start
 
-        idx_path, ch_path = _index_paths(dept)
-        faiss.write_index(index, str(idx_path))
-        with open(ch_path, "wb") as f:
-            pickle.dump(chunks, f)
+    departments = {"global": sum(len(f["ids"]) for f in files.values())}
+    for f in files.values():
+        departments[f["dept"]] = departments.get(f["dept"], 0) + len(f["ids"])
+    return {
+        "added": added,
+        "changed": changed,
+        "removed": removed,
+        "unchanged": len(current) - len(added) - len(changed),
+        "errors": errors,
+        "chunks": departments,
+        "rebuilt": sorted(affected | set(reindexed) | ({"global"} if rebuild_global else set())),
+        "indexes": index_specs,
+        "contacts": sum(len(v) for v in contacts.values()),
+        "timings": {k: round(v, 3) for k, v in timings.items()},
+    }
 
-        summary[dept] = {"chunks": len(chunks), "built": True}
-    return summary
+def _file_signature(*paths: Path) -> Tuple:
+    sig = []
+    for p in paths:
+        st = p.stat()
+        sig.append((st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+def _evict_locked():
+    total = sum(e["bytes"] for e in _index_cache.values())
+    while len(_index_cache) > 1 and (
+        len(_index_cache) > INDEX_CACHE_MAX_ENTRIES or total > INDEX_CACHE_MAX_BYTES
+    ):
+        _, old = _index_cache.popitem(last=False)
+        total -= old["bytes"]
+
+def _read_index(path: Path):
+    """(index, mapped): memory-mapped when INDEX_MMAP is on and FAISS supports it."""
+    if INDEX_MMAP:
+        # MMAP_IFC maps the vector codes of flat, HNSW and IVF indexes alike
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        try:
+            return faiss.read_index(str(path), flags), True
+        except RuntimeError:
+            pass
+    return faiss.read_index(str(path)), False
 
 def _load_index_and_chunks(dept: str):
+    """
+    (FAISS index, chunk store) for a department, from the LRU cache when unchanged.
+    Chunk stores are memory-mapped, so only the index counts towards the byte budget.
+    """
+    key = slug(dept)
     idx_path, ch_path = _index_paths(dept)  # already slugged
-    if not (idx_path.exists() and ch_path.exists()):
+    if not (idx_path.exists() and (key == "global" or ch_path.exists())):
         raise FileNotFoundError(f"Index for '{dept}' not found. Build indexes first.")
-    index = faiss.read_index(str(idx_path))
-    with open(ch_path, "rb") as f:
-        chunks = pickle.load(f)
+    # global is rewritten whenever a department changes, so its index signature suffices
+    sig = _file_signature(idx_path) if key == "global" else _file_signature(idx_path, ch_path)
+    with _index_cache_lock:
+        entry = _index_cache.get(key)
+        if entry is not None and entry["sig"] == sig:
+            _index_cache.move_to_end(key)
+            return entry["index"], entry["chunks"]
+
+    # load outside the lock so other departments stay servable meanwhile
+    index, mapped = _read_index(idx_path)
+    _apply_search_params(index)
+    if key == "global":
+        stores = [ChunkStore(p) for p in sorted(INDEX_DIR.glob("*.chunks")) if p.stem != "global"]
+        chunks = MultiChunkStore(stores)
+    else:
+        chunks = ChunkStore(ch_path)
+    nbytes = 0 if mapped else sig[0][1]
+
+    with _index_cache_lock:
+        _index_cache[key] = {"sig": sig, "index": index, "chunks": chunks, "bytes": nbytes}
+        _index_cache.move_to_end(key)
+        _evict_locked()
     return index, chunks
 
-def search_in_dept(query: str, dept: str, k: int = 4):
+def embed_queries(queries: List[str]) -> np.ndarray:
+    """
+    Encode queries; rows are L2-normalised float32.
+    Previously seen queries come from the embedding cache; the rest share one model
+    call, batched with other requests' queries arriving at the same time.
+    """
+    keys = [normalize_query(q) for q in queries]
+    cached = [_query_emb_cache.get(k) for k in keys]
+    missing = {}
+    for q, k, v in zip(queries, keys, cached):
+        if v is None and k not in missing:
+            missing[k] = q
+    if missing:
+        emb = get_encoder().submit(list(missing.values()))
+        fresh = dict(zip(missing, emb))
+        for k, v in fresh.items():
+            _query_emb_cache.set(k, v)
+        cached = [fresh[k] if v is None else v for k, v in zip(keys, cached)]
+    return np.vstack(cached)
+
+def _load_lexical(dept: str) -> BM25Index:
+    key = slug(dept)
+    path = _lexical_path(dept)
+    if not path.exists():
+        raise FileNotFoundError(f"Lexical index for '{dept}' not found. Build indexes first.")
+    sig = _file_signature(path)
+    with _index_cache_lock:
+        entry = _lexical_cache.get(key)
+        if entry is not None and entry[0] == sig:
+            _lexical_cache.move_to_end(key)
+            return entry[1]
+    index = BM25Index.load(path)
+    with _index_cache_lock:
+        _lexical_cache[key] = (sig, index)
+        _lexical_cache.move_to_end(key)
+        while len(_lexical_cache) > INDEX_CACHE_MAX_ENTRIES:
+            _lexical_cache.popitem(last=False)
+    return index
+
+def search_lexical(queries: Sequence[str], dept: str, k: int = 4) -> List[List[Tuple[str, float, dict]]]:
+    """
+    BM25 search of one department; no query embedding needed.
+    Hits are (chunk, coverage, meta) like search_vectors, with coverage (0..1, the
+    idf-weighted share of query terms found) as the score and the raw BM25 in meta.
+    """
+    lexical = _load_lexical(dept)
+    _, chunks = _load_index_and_chunks(dept)
+    hits = []
+    for q in queries:
+        row = []
+        for cid, bm25, coverage in lexical.search(q, k):
+            text = chunks.get(cid)
+            if text is not None:
+                row.append((text, coverage, {**chunks.meta(cid), "bm25": round(bm25, 3)}))
+        hits.append(row)
+    return hits
+
+def dept_similarities(q_emb: np.ndarray) -> List[Dict[str, float]]:
+    """
+    Cosine of each query row against every department centroid (one small matrix
+    product). Returns empty dicts if centroids haven't been built yet.
+    """
+    global _centroids
+    try:
+        sig = _file_signature(CENTROIDS_PATH)
+    except FileNotFoundError:
+        return [{} for _ in range(len(q_emb))]
+    if _centroids is None or _centroids[0] != sig:
+        with np.load(CENTROIDS_PATH) as z:
+            _centroids = (sig, [str(d) for d in z["depts"]], z["vecs"])
+    _, depts, vecs = _centroids
+    return [dict(zip(depts, map(float, row))) for row in q_emb @ vecs.T]
+
+class ExactVectors:
+    """
+    Full-precision vectors of a department, memory-mapped from <dept>.vecs.npy,
+    for re-scoring candidates from a compressed index. Only the id -> row lookup
+    is resident (8-16 bytes per vector); rows are read on demand.
+    """
+
+    def __init__(self, vec_path: Path, ids_path: Path):
+        self.vecs = np.load(vec_path, mmap_mode="r")
+        ids = np.load(ids_path)
+        self.order = None if np.all(ids[1:] > ids[:-1]) else np.argsort(ids, kind="stable")
+        self.sorted_ids = ids if self.order is None else ids[self.order]
+
+    def rows(self, ids: np.ndarray) -> np.ndarray:
+        pos = np.minimum(np.searchsorted(self.sorted_ids, ids), len(self.sorted_ids) - 1)
+        pos[self.sorted_ids[pos] != ids] = -1
+        return pos if self.order is None else np.where(pos >= 0, self.order[pos], -1)
+
+    def rescore(self, q_emb: np.ndarray, I: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact inner products for each row's candidate ids; best k first (-1 padded)."""
+        D_out = np.full((len(I), k), -np.inf, dtype="float32")
+        I_out = np.full((len(I), k), -1, dtype="int64")
+        for r in range(len(I)):
+            cand = I[r][I[r] >= 0]
+            rows = self.rows(cand)
+            cand, rows = cand[rows >= 0], rows[rows >= 0]
+            if not len(cand):
+                continue
+            order = np.argsort(rows)   # ascending reads from the mapped file
+            scores = np.empty(len(rows), dtype="float32")
+            scores[order] = np.asarray(self.vecs[rows[order]], dtype="float32") @ q_emb[r]
+            top = np.argsort(-scores, kind="stable")[:k]
+            D_out[r, :len(top)] = scores[top]
+            I_out[r, :len(top)] = cand[top]
+        return D_out, I_out
+
+def _load_exact(dept: str) -> ExactVectors:
+    key = slug(dept)
+    vec_path, ids_path = _vector_paths(dept)
+    sig = _file_signature(vec_path, ids_path)
+    with _index_cache_lock:
+        entry = _exact_cache.get(key)
+        if entry is not None and entry[0] == sig:
+            return entry[1]
+    exact = ExactVectors(vec_path, ids_path)
+    with _index_cache_lock:
+        _exact_cache[key] = (sig, exact)
+    return exact
+
+_LOSSY_INDEX_TYPES = tuple(getattr(faiss, name) for name in (
+    "IndexScalarQuantizer", "IndexPQ", "IndexIVFScalarQuantizer", "IndexIVFPQ",
+    "IndexHNSWSQ", "IndexHNSWPQ") if hasattr(faiss, name))
+
+def _is_lossy(index) -> bool:
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    return isinstance(inner, _LOSSY_INDEX_TYPES)
+
+def search_vectors(q_emb: np.ndarray, dept: str, k: int = 4) -> List[List[Tuple[str, float, dict]]]:
+    """
+    Search one department with pre-computed query vectors.
+    One list of (chunk, score, meta) per row; meta = {id, source, dept, start, page}.
+    Compressed indexes return exact float32 scores (candidates re-scored, see RESCORE_FACTOR).
+    """
     index, chunks = _load_index_and_chunks(dept)  # dept can be any form; paths are slugged
-    model = SentenceTransformer(EMB_MODEL_NAME)
-    q_emb = model.encode([query], convert_to_numpy=True)
-    faiss.normalize_L2(q_emb)
-    D, I = index.search(q_emb, k)
-    return [(chunks[i], float(D[0][j])) for j, i in enumerate(I[0])]
\ No newline at end of file
+    exact = None
+    if RESCORE_FACTOR > 1 and _is_lossy(index):
+        try:
+            exact = _load_exact(dept)
+        except FileNotFoundError:
+            pass   # approximate scores are still usable
+    if exact is not None:
+        _, I = index.search(q_emb, k * RESCORE_FACTOR)
+        D, I = exact.rescore(q_emb, I, k)
+    else:
+        D, I = index.search(q_emb, k)
+    hits = []
+    for r in range(len(q_emb)):
+        row = []
+        for d, i in zip(D[r], I[r]):
+            text = chunks.get(int(i)) if i >= 0 else None
+            if text is not None:
+                row.append((text, float(d), chunks.meta(int(i))))
+        hits.append(row)
+    return hits
+
+def _get_search_pool() -> ThreadPoolExecutor:
+    global _search_pool
+    if _search_pool is None:
+        with _index_cache_lock:
+            if _search_pool is None:
+                _search_pool = ThreadPoolExecutor(max_workers=SEARCH_THREADS,
+                                                  thread_name_prefix="faiss-search")
+    return _search_pool
+
+def search_depts(q_emb: np.ndarray, dept_rows: Dict[str, Sequence[int]],
+                 k: int = 4) -> Dict[str, Dict[int, List[Tuple[str, float, dict]]]]:
+    """
+    Search several departments with already-encoded queries.
+    dept_rows maps dept -> rows of q_emb to search there; returns {dept: {row: hits}}
+    with hits as in search_vectors.
+    Departments without a built index are left out of the result.
+    """
+    def one(item):
+        dept, rows = item
+        rows = list(rows)
+        try:
+            hits = search_vectors(q_emb[rows], dept, k)
+        except FileNotFoundError:
+            return dept, None
+        return dept, dict(zip(rows, hits))
+
+    items = [(d, rows) for d, rows in dept_rows.items() if len(rows)]
+    if len(items) > 1:
+        results = list(_get_search_pool().map(one, items))
+    else:
+        results = [one(it) for it in items]
+    return {d: hits for d, hits in results if hits is not None}
+
+def preload_indexes(warm_model: bool = True) -> Dict[str, float]:
+    """
+    Load every index listed in the manifest (plus the query encoder) up front, so no
+    user query pays first-touch cost. One throwaway search per index also pulls mapped
+    pages into the page cache. Returns {name: load ms}; departments whose files are
+    missing are skipped.
+    """
+    manifest = _load_manifest()
+    timings = {}
+    if warm_model:
+        t = time.perf_counter()
+        embed_queries(["warm up"])
+        timings["model"] = round((time.perf_counter() - t) * 1000, 1)
+    for dept in (manifest or {}).get("indexes", {}):
+        t = time.perf_counter()
+        try:
+            index, _ = _load_index_and_chunks(dept)
+        except FileNotFoundError:
+            continue
+        index.search(np.zeros((1, index.d), dtype="float32"), 1)
+        if RESCORE_FACTOR > 1 and _is_lossy(index):
+            try:
+                _load_exact(dept)
+            except FileNotFoundError:
+                pass
+        try:
+            _load_lexical(dept)
+        except FileNotFoundError:
+            pass
+        timings[dept] = round((time.perf_counter() - t) * 1000, 1)
+    return timings
+
+def search_in_dept(query: str, dept: str, k: int = 4):
+    return [(c, s) for c, s, _ in search_vectors(embed_queries([query]), dept, k)[0]]
+
+def index_report(dept: str, k: int = 4, n_queries: int = 200, queries: List[str] = None,
+                 kinds: Sequence[str] = ("flat", "hnsw", "ivf_flat", "ivf_pq"),
+                 ef_values: Sequence[int] = (16, 32, 64, 128),
+                 nprobe_values: Sequence[int] = (1, 4, 16, 64),
+                 codecs: Sequence[str] = ("fp32",)) -> List[dict]:
+    """
+    Recall@k, latency and size of each index type x vector codec on a department's
+    stored vectors, against exact (flat) search, to pick INDEX_TYPES / VECTOR_CODECS /
+    efSearch / nprobe knowingly.
+    - queries: real questions to encode; by default n_queries stored chunk vectors are used
+    - one row per (type, codec, search knob): spec, param, recall, ms/query, build
+      time, index size and bytes per vector; lossy codecs also get the recall and
+      latency with exact re-scoring of RESCORE_FACTOR x k candidates, as served
+    - e.g. codecs=("fp32", "fp16", "sq8", "pq") for the memory-vs-recall table
+    Indexes are built in memory; nothing on disk changes.
+    """
+    vec_path, ids_path = _vector_paths(dept)
+    if not (vec_path.exists() and ids_path.exists()):
+        raise FileNotFoundError(f"Vectors for '{dept}' not found. Build indexes first.")
+    vecs, ids = np.load(vec_path), np.load(ids_path)
+    if queries:
+        q = embed_queries(queries)
+    else:
+        rng = np.random.default_rng(0)
+        q = vecs[rng.choice(len(vecs), size=min(n_queries, len(vecs)), replace=False)]
+
+    exact = _build_index("IDMap,Flat", vecs, ids)
+    _, truth = exact.search(q, k)
+    rescorer = ExactVectors(vec_path, ids_path)
+
+    def recall(found):
+        return round(float(np.mean([len(set(f) & set(g)) / k for f, g in zip(found, truth)])), 4)
+
+    rows = []
+    seen = set()
+    for kind in kinds:
+        for codec in codecs:
+            spec = _index_factory_string(kind, len(ids), vecs.shape[1], codec)
+            if spec in seen:   # e.g. ivf_pq ignores the codec
+                continue
+            seen.add(spec)
+            t = time.perf_counter()
+            index = _build_index(spec, vecs, ids)
+            build_s = time.perf_counter() - t
+            size = faiss.serialize_index(index).nbytes
+            lossy = _is_lossy(index)
+            if "HNSW" in spec:
+                sweep = [("efSearch", v) for v in ef_values]
+            elif "IVF" in spec:
+                sweep = [("nprobe", v) for v in nprobe_values]
+            else:
+                sweep = [(None, None)]
+            for param, value in sweep:
+                if param == "efSearch":
+                    _apply_search_params(index, ef_search=value)
+                elif param == "nprobe":
+                    _apply_search_params(index, nprobe=value)
+                t = time.perf_counter()
+                found = np.vstack([index.search(q[i:i + 1], k)[1] for i in range(len(q))])
+                ms = (time.perf_counter() - t) * 1000 / len(q)
+                row = {
+                    "type": kind, "codec": codec, "spec": spec,
+                    "param": f"{param}={value}" if param else "",
+                    f"recall@{k}": recall(found),
+                    "ms_per_query": round(ms, 3),
+                    f"recall@{k}_rescored": None,
+                    "ms_per_query_rescored": None,
+                    "build_s": round(build_s, 2),
+                    "index_mb": round(size / 1e6, 1),
+                    "bytes_per_vector": round(size / len(ids), 1),
+                }
+                if lossy and RESCORE_FACTOR > 1:
+                    t = time.perf_counter()
+                    found = np.vstack([
+                        rescorer.rescore(q[i:i + 1], index.search(q[i:i + 1], k * RESCORE_FACTOR)[1], k)[1]
+                        for i in range(len(q))])
+                    row[f"recall@{k}_rescored"] = recall(found)
+                    row["ms_per_query_rescored"] = round((time.perf_counter() - t) * 1000 / len(q), 3)
+                rows.append(row)
+    return rows
+
+def export_encoder(out_dir: str, backend: str = "onnx", quantize: str = None) -> str:
+    """
+    Export EMB_MODEL_NAME for a faster CPU backend into out_dir (set EMB_MODEL_PATH
+    to it). With backend="onnx", quantize ("avx512_vnni", "avx2", "arm64", ...)
+    also writes dynamically int8-quantized weights. Returns the EMB_MODEL_FILE to use.
+    """
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    model = _load_encoder(backend)   # converted on load if the hub has no such export
+    model.save(out_dir)
+    if backend == "onnx" and quantize:
+        export_dynamic_quantized_onnx_model(model, quantize, out_dir)
+        return f"onnx/model_qint8_{quantize}.onnx"
+    return "onnx/model.onnx" if backend == "onnx" else "openvino/openvino_model.xml"
+
+def encoder_parity_report(backend: str, model_file: str = None, model_path: str = None,
+                          n_chunks: int = 500, queries: List[str] = None, k: int = 4) -> dict:
+    """
+    Compare a candidate encoder backend against the PyTorch model on our corpus.
+    - chunk_cosine: cosine between the two embeddings of the same chunk (1.0 = identical)
+    - score_abs_diff: |query-chunk cosine, candidate - reference|, the error the
+      retrieval threshold sees
+    - topk_overlap: share of each query's reference top-k chunks the candidate also ranks top-k
+    - ms_per_chunk for both (encode time, batch of n_chunks)
+    queries default to the opening words of sampled chunks.
+    """
+    manifest = _load_manifest() or {}
+    texts = []
+    for dept in manifest.get("indexes", {}):
+        _, ch_path = _index_paths(dept)
+        if dept != "global" and ch_path.exists():
+            texts.extend(text for _, text, _ in ChunkStore(ch_path).records())
+    if not texts:
+        raise FileNotFoundError("No chunks found. Build indexes first.")
+    rng = np.random.default_rng(0)
+    texts = [texts[i] for i in rng.choice(len(texts), size=min(n_chunks, len(texts)), replace=False)]
+    queries = queries or [" ".join(t.split()[:12]) for t in texts[: min(50, len(texts))]]
+    k = min(k, len(texts))
+
+    def run(model):
+        t = time.perf_counter()
+        emb = model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+        ms = (time.perf_counter() - t) * 1000 / len(texts)
+        q = model.encode(queries, convert_to_numpy=True, normalize_embeddings=True)
+        return np.asarray(emb, dtype="float32"), np.asarray(q, dtype="float32"), ms
+
+    ref_emb, ref_q, ref_ms = run(_load_encoder("torch"))
+    cand_emb, cand_q, cand_ms = run(_load_encoder(backend, model_file, model_path))
+    chunk_cos = np.sum(ref_emb * cand_emb, axis=1)
+    ref_scores, cand_scores = ref_q @ ref_emb.T, cand_q @ cand_emb.T
+    diff = np.abs(ref_scores - cand_scores)
+    ref_top = np.argsort(-ref_scores, axis=1)[:, :k]
+    cand_top = np.argsort(-cand_scores, axis=1)[:, :k]
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, cand_top)])
+    return {
+        "backend": backend, "model_file": model_file,
+        "chunks": len(texts), "queries": len(queries),
+        "chunk_cosine_mean": round(float(chunk_cos.mean()), 5),
+        "chunk_cosine_min": round(float(chunk_cos.min()), 5),
+        "score_abs_diff_mean": round(float(diff.mean()), 5),
+        "score_abs_diff_max": round(float(diff.max()), 5),
+        f"top{k}_overlap": round(float(overlap), 4),
+        "ms_per_chunk_torch": round(ref_ms, 3),
+        "ms_per_chunk_candidate": round(cand_ms, 3),
+    }
@@ -1,5 +1,6 @@
 import re
-from typing import List, Tuple
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
 from app.config import (
     EMERGENCY_MESSAGE, NON_URGENT_ADVICE_MESSAGE, LOW_CONF_FALLBACK,
     RETRIEVAL_SIM_THRESHOLD, MIN_STRONG_MATCHES
@@ -43,50 +44,187 @@ DOB_RE     = re.compile(r"\b(?:\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|(?:Jan|Feb|Mar|Apr|
 MRN_HINTS  = re.compile(r"\b(MRN|medical record|health number|PHN)\b", re.IGNORECASE)
 NAME_HINTS = re.compile(r"\bmy name is\b", re.IGNORECASE)
 
+# Post-generation check: advice-like wording in model output
+ADVICE_LANGUAGE_RE = re.compile(r"\b(you should|take|start|use|dose|dosage|prescribe|avoid)\b")
+
+# --- Compiled guardrail engine ---
+
+def _keyword_trie(words: Iterable[str]) -> str:
+    """
+    Regex for a keyword set with plain substring semantics (same as `kw in text`),
+    emitted as a character trie so a scan does about one comparison per character.
+    """
+    trie: dict = {}
+    for w in words:
+        node = trie
+        for ch in w.lower():
+            node = node.setdefault(ch, {})
+        node[""] = {}  # end of a keyword
+
+    def emit(node: dict) -> str:
+        alts = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = "(?:" + "|".join(alts) + ")" if len(alts) > 1 else alts[0]
+        if "" in node:
+            return f"(?:{body})?"
+        return body
+
+    return emit(trie)
+
+def _lowercase_literals(pattern: str) -> str:
+    """Lower-case a pattern's literal letters (not escapes like \\b, \\d) so it can run
+    case-sensitively on lower-cased text, which is much faster than re.IGNORECASE."""
+    return re.sub(r"\\.|[A-Z]", lambda m: m.group(0) if len(m.group(0)) == 2 else m.group(0).lower(), pattern)
+
+class GuardrailEngine:
+    """
+    Compiled classifier for several guardrail categories.
+    - The text is lower-cased once; patterns are compiled in lower case (no IGNORECASE).
+    - Each category is a list of (pattern, precondition) parts. A part whose
+      precondition regex (e.g. "@" for e-mails, a digit for phone numbers) finds
+      nothing is skipped, so the expensive PII regexes only run when they could match.
+    - Reported spans index into text.lower().
+    """
+
+    def __init__(self, categories: Dict[str, List[Tuple[str, Optional[str]]]]):
+        self.names = list(categories)
+        guards: Dict[Optional[str], "re.Pattern"] = {}
+        self._parts = {}
+        for name, parts in categories.items():
+            compiled = []
+            for pattern, guard in parts:
+                if guard is not None and guard not in guards:
+                    guards[guard] = re.compile(guard)
+                compiled.append((re.compile(pattern), guard))
+            self._parts[name] = compiled
+        self._guards = guards
+
+    def scan(self, text: str) -> Dict[str, Tuple[int, int]]:
+        """{category: (start, end) of its earliest match} for every category that matches."""
+        t = text.lower()
+        guard_hits: Dict[str, bool] = {}
+        found: Dict[str, Tuple[int, int]] = {}
+        for name in self.names:
+            best = None
+            for rx, guard in self._parts[name]:
+                if guard is not None:
+                    if guard not in guard_hits:
+                        guard_hits[guard] = self._guards[guard].search(t) is not None
+                    if not guard_hits[guard]:
+                        continue
+                m = rx.search(t)
+                if m and (best is None or m.start() < best[0]):
+                    best = m.span()
+            if best is not None:
+                found[name] = best
+        return found
+
+_DIGIT = r"\d"
+
+QUERY_ENGINE = GuardrailEngine({
+    "emergency": [(_keyword_trie(EMERGENCY_KEYWORDS), None)],
+    "pii": [
+        (_lowercase_literals(EMAIL_RE.pattern), "@"),
+        (_lowercase_literals(PHONE_RE.pattern), _DIGIT),
+        (_lowercase_literals(DOB_RE.pattern), _DIGIT),
+        (_lowercase_literals(MRN_HINTS.pattern) + "|" + _lowercase_literals(NAME_HINTS.pattern), None),
+    ],
+    "medical_advice": [("|".join(_lowercase_literals(p) for p in MEDICAL_ADVICE_PATTERNS), None)],
+    "contact_intent": [(_keyword_trie(CONTACT_INTENT), None)],
+    "profanity": [(_keyword_trie(PROFANITY), None)],
+})
+ANSWER_ENGINE = GuardrailEngine({
+    "advice_language": [(_lowercase_literals(ADVICE_LANGUAGE_RE.pattern), None)],
+})
+
+def _is_medical_advice(matches: Dict[str, Tuple[int, int]]) -> bool:
+    # ✅ If clearly a contact/wayfinding request, do NOT treat as medical advice;
+    # profanity is handled separately, but still treat as out-of-scope
+    return "medical_advice" in matches and not ("contact_intent" in matches or "profanity" in matches)
+
+def _query_category(matches: Dict[str, Tuple[int, int]]) -> Optional[str]:
+    """Which query guardrail blocks, in priority order (None = allowed)."""
+    if "emergency" in matches:
+        return "emergency"
+    if "pii" in matches:
+        return "pii"
+    if _is_medical_advice(matches):
+        return "medical_advice"
+    return None
+
+def _verdict(category: Optional[str], matches: Dict[str, Tuple[int, int]], start: float) -> dict:
+    return {
+        "category": category,
+        "span": matches.get(category) if category else None,
+        "matches": matches,
+        "elapsed_ms": (time.perf_counter() - start) * 1000,
+    }
+
+def classify_query(text: str) -> dict:
+    """
+    Structured verdict for a user query:
+      {"category": "emergency" | "pii" | "medical_advice" | None,
+       "span": (start, end) | None, "matches": {category: span}, "elapsed_ms": float}
+    """
+    start = time.perf_counter()
+    matches = QUERY_ENGINE.scan(text)
+    return _verdict(_query_category(matches), matches, start)
+
+def classify_answer(text: str) -> dict:
+    """Structured verdict for generated text ("advice_language" or None)."""
+    start = time.perf_counter()
+    matches = ANSWER_ENGINE.scan(text)
+    return _verdict("advice_language" if matches else None, matches, start)
+
+def classify_queries(texts: Iterable[str]) -> List[dict]:
+    """Batch screening, e.g. over a query log."""
+    return [classify_query(t) for t in texts]
+
+def classify_answers(texts: Iterable[str]) -> List[dict]:
+    """Batch screening of LLM outputs."""
+    return [classify_answer(t) for t in texts]
+
 def contains_emergency(text: str) -> bool:
-    t = text.lower()
-    return any(kw in t for kw in EMERGENCY_KEYWORDS)
+    return "emergency" in QUERY_ENGINE.scan(text)
 
 def requests_medical_advice(text: str) -> bool:
-    t = text.lower()
-      # ✅ If clearly a contact/wayfinding request, do NOT treat as medical advice
-    if any(kw in t for kw in CONTACT_INTENT):
-        return False
-    if any(w in t for w in PROFANITY):
-        # profanity is handled separately, but still treat as out-of-scope
-        return False
-    return any(re.search(pat, t) for pat in MEDICAL_ADVICE_PATTERNS)
+    return _is_medical_advice(QUERY_ENGINE.scan(text))
 
 def contains_pii(text: str) -> bool:
-    return bool(
-        EMAIL_RE.search(text) or PHONE_RE.search(text) or DOB_RE.search(text)
-        or MRN_HINTS.search(text) or NAME_HINTS.search(text)
-    )
+    return "pii" in QUERY_ENGINE.scan(text)
 
 def retrieval_strength(scores: List[float]) -> Tuple[int, float]:
     """Return (# of strong matches, best score)."""
     strong = [s for s in scores if s >= RETRIEVAL_SIM_THRESHOLD]
     return len(strong), (max(scores) if scores else 0.0)
 
-def pre_answer_guardrails(user_text: str, retrieved_scores: List[float]):
-    """Return (allow_generation: bool, message_if_blocked: str or None)."""
-    t = user_text.lower()
-    is_contact = any(k in t for k in CONTACT_INTENT)
-
-    # 1) Emergencies
-    if contains_emergency(user_text):
-        return False, EMERGENCY_MESSAGE
-
-    # 2) PII
-    if contains_pii(user_text):
-        return False, (
-            "For your privacy, please **don’t share personal details** (name, email, phone, MRN, "
-            "DOB, or medical history) here. Ask your question without personal identifiers."
-        )
+PII_MESSAGE = (
+    "For your privacy, please **don’t share personal details** (name, email, phone, MRN, "
+    "DOB, or medical history) here. Ask your question without personal identifiers."
+)
 
-    # 3) Medical advice
-    if requests_medical_advice(user_text):
-        return False, NON_URGENT_ADVICE_MESSAGE
+_QUERY_BLOCK_MESSAGES = {
+    "emergency": EMERGENCY_MESSAGE,
+    "pii": PII_MESSAGE,
+    "medical_advice": NON_URGENT_ADVICE_MESSAGE,
+}
+
+def query_guardrails(user_text: str, verdict: Optional[dict] = None):
+    """
+    Checks that depend only on the query text (emergency, PII, medical advice).
+    Cheap, so they run before retrieval. Returns (allow, message_if_blocked).
+    """
+    # 1) Emergencies  2) PII  3) Medical advice -- one engine pass, in that priority
+    verdict = verdict or classify_query(user_text)
+    if verdict["category"]:
+        return False, _QUERY_BLOCK_MESSAGES[verdict["category"]]
+    return True, None
+
+def retrieval_guardrails(user_text: str, retrieved_scores: List[float], verdict: Optional[dict] = None):
+    """Retrieval-strength (hallucination) guard. Returns (allow, message_if_blocked)."""
+    verdict = verdict or classify_query(user_text)
+    is_contact = "contact_intent" in verdict["matches"]
 
     # 4) Retrieval strength (hallucination guard)
     # count, best = retrieval_strength(retrieved_scores)
@@ -108,17 +246,71 @@ def pre_answer_guardrails(user_text: str, retrieved_scores: List[float]):
 
     return True, None
 
+def pre_answer_guardrails(user_text: str, retrieved_scores: List[float]):
+    """Return (allow_generation: bool, message_if_blocked: str or None)."""
+    verdict = classify_query(user_text)
+    allow, msg = query_guardrails(user_text, verdict)
+    if not allow:
+        return allow, msg
+    return retrieval_guardrails(user_text, retrieved_scores, verdict)
+
 def post_answer_guardrails(generated_text: str):
     """Light post-check to ensure we didn't accidentally provide medical advice."""
     # If the model slipped and gave advice words—very conservative check
-    t = generated_text.lower()
-    if re.search(r"\b(you should|take|start|use|dose|dosage|prescribe|avoid)\b", t):
+    if classify_answer(generated_text)["category"]:
         return (
             False,
             NON_URGENT_ADVICE_MESSAGE + " I can help with hospital locations, hours, and services if you’d like."
         )
     return True, None
 
+class StreamingAnswerGuard:
+    """
+    Incremental post_answer_guardrails for streamed answers.
+    - Text is released only up to the last whitespace, so a word is checked
+      once it is complete and a tripping phrase never reaches the user.
+    - Each check scans only the newly completed text plus a short look-back
+      (aligned to a word start) for multi-word phrases like "you should".
+    """
+
+    LOOKBACK = 16
+
+    def __init__(self):
+        self.text = ""
+        self.released = 0
+        self.blocked_msg = None
+
+    def _check(self, end: int) -> bool:
+        start = max(0, self.released - self.LOOKBACK)
+        while start > 0 and not self.text[start - 1].isspace():
+            start -= 1
+        ok, msg = post_answer_guardrails(self.text[start:end])
+        if not ok:
+            self.blocked_msg = msg
+        return ok
+
+    def feed(self, piece: str) -> str:
+        """Add a streamed piece; return the text that is now safe to show ('' if blocked)."""
+        if self.blocked_msg:
+            return ""
+        self.text += piece
+        end = max(self.text.rfind(" "), self.text.rfind("\n")) + 1
+        if end <= self.released:
+            return ""
+        if not self._check(end):
+            return ""
+        out, self.released = self.text[self.released:end], end
+        return out
+
+    def flush(self) -> str:
+        """Check and release whatever is left once the stream has ended."""
+        if self.blocked_msg or self.released >= len(self.text):
+            return ""
+        if not self._check(len(self.text)):
+            return ""
+        out, self.released = self.text[self.released:], len(self.text)
+        return out
+
 def extract_contacts(texts):
     phones = set()
     flags = set()
@@ -0,0 +1,130 @@
+import heapq
+import math
+import pickle
+import re
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# Words, numbers and hyphen/dot compounds ("310-mhsu", "250-374-5111", "7.30am").
+# A compound is indexed whole *and* as its parts, so "310-MHSU" and "MHSU" both match;
+# one-letter parts are dropped ("what's" / "Women's" must not share the term "s").
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-.'][a-z0-9]+)*")
+_SPLIT_RE = re.compile(r"[-.']")
+
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from how i if in is it me my of on or our
+please the their there this to what when where which who whom why will with you your
+""".split())
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def tokenize(text: str) -> List[str]:
+    out = []
+    for tok in _TOKEN_RE.findall(text.lower()):
+        parts = _SPLIT_RE.split(tok)
+        if len(parts) > 1:
+            out.append(tok)
+            parts = [p for p in parts if len(p) > 1]
+        out.extend(p for p in parts if p and p not in STOPWORDS)
+    return out
+
+class BM25Index:
+    """
+    Okapi BM25 over one department's chunks (pure Python, small enough to pickle).
+    - postings: term -> (doc positions, term frequencies) as compact arrays
+    - search() returns (chunk id, bm25, coverage); coverage is the idf-weighted share
+      of the query's terms found in the chunk (0..1), a score that stays comparable
+      across queries, unlike raw BM25.
+    """
+
+    def __init__(self):
+        self.doc_ids = array("q")
+        self.doc_len = array("i")
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.avgdl = 1.0
+
+    @classmethod
+    def build(cls, docs: Iterable[Tuple[int, str]]) -> "BM25Index":
+        """docs: (chunk id, text) pairs."""
+        index = cls()
+        for cid, text in docs:
+            index._add(cid, tokenize(text))
+        index._update_stats()
+        return index
+
+    def _update_stats(self):
+        n = len(self.doc_len)
+        self.avgdl = (sum(self.doc_len) / n if n else 0.0) or 1.0
+
+    def _add(self, cid: int, tokens: List[str]):
+        pos = len(self.doc_ids)
+        self.doc_ids.append(int(cid))
+        self.doc_len.append(len(tokens))
+        tf: Dict[str, int] = {}
+        for t in tokens:
+            tf[t] = tf.get(t, 0) + 1
+        for t, n in tf.items():
+            entry = self.postings.get(t)
+            if entry is None:
+                entry = self.postings[t] = (array("i"), array("i"))
+            entry[0].append(pos)
+            entry[1].append(n)
+
+    @classmethod
+    def merge(cls, indexes: Sequence["BM25Index"]) -> "BM25Index":
+        """One index over several (id-disjoint) indexes, e.g. 'global' from the departments."""
+        merged = cls()
+        for index in indexes:
+            base = len(merged.doc_ids)
+            merged.doc_ids.extend(index.doc_ids)
+            merged.doc_len.extend(index.doc_len)
+            for t, (docs, tfs) in index.postings.items():
+                entry = merged.postings.get(t)
+                if entry is None:
+                    entry = merged.postings[t] = (array("i"), array("i"))
+                entry[0].extend(d + base for d in docs)
+                entry[1].extend(tfs)
+        merged._update_stats()
+        return merged
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def idf(self, term: str) -> float:
+        n = len(self.doc_ids)
+        df = len(self.postings[term][0]) if term in self.postings else 0
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[int, float, float]]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.doc_ids:
+            return []
+        total_idf = 0.0
+        scores: Dict[int, float] = {}
+        covered: Dict[int, float] = {}
+        for t in terms:
+            idf = self.idf(t)
+            total_idf += idf   # unseen terms count too: they lower coverage
+            if t not in self.postings:
+                continue
+            docs, tfs = self.postings[t]
+            for d, tf in zip(docs, tfs):
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[d] / self.avgdl)
+                scores[d] = scores.get(d, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+                covered[d] = covered.get(d, 0.0) + idf
+        top = heapq.nlargest(k, scores.items(), key=lambda x: x[1])
+        return [(self.doc_ids[d], s, covered[d] / total_idf) for d, s in top]
+
+    def save(self, path: Path):
+        with open(path, "wb") as f:
+            pickle.dump((self.doc_ids, self.doc_len, self.postings), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        index = cls()
+        with open(path, "rb") as f:
+            index.doc_ids, index.doc_len, index.postings = pickle.load(f)
+        index._update_stats()
+        return index
@@ -0,0 +1,266 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, Iterator, Optional
+
+_DONE = object()
+
+
+class EngineBusy(RuntimeError):
+    """Raised when the engine can't take (or finish) a request in time."""
+
+
+class EngineTimeout(EngineBusy):
+    """Request was accepted but didn't complete before its deadline."""
+
+
+class LLMEngine:
+    """
+    Long-lived LLM engine shared by the whole process.
+    - `loader()` builds one model per worker thread (a llama.cpp context is not thread-safe).
+    - Models are loaded once, on the worker's first request, and kept warm afterwards.
+    - Requests wait in a bounded queue; when it's full we fail fast with EngineBusy
+      instead of letting callers pile up.
+    """
+
+    def __init__(self, loader: Callable[[], Any], workers: int = 1,
+                 max_queue: int = 8, timeout: float = 120.0):
+        self.loader = loader
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "expired": 0,
+                       "models_loaded": 0}
+
+    def start(self):
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"llm-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _worker(self):
+        model = None
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                fut, fn, deadline = item
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                if time.monotonic() > deadline:
+                    # caller already gave up while this sat in the queue
+                    self._count("expired")
+                    fut.set_exception(EngineTimeout("request expired in queue"))
+                    continue
+                try:
+                    if model is None:
+                        model = self.loader()
+                        self._count("models_loaded")
+                    fut.set_result(fn(model))
+                    self._count("completed")
+                except Exception as e:
+                    self._count("failed")
+                    fut.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, fn: Callable[[Any], Any], timeout: Optional[float] = None) -> Future:
+        """Queue `fn(model)` for a worker. Raises EngineBusy if the queue is full."""
+        self.start()
+        timeout = self.timeout if timeout is None else timeout
+        fut: Future = Future()
+        try:
+            self._queue.put_nowait((fut, fn, time.monotonic() + timeout))
+        except queue.Full:
+            self._count("rejected")
+            raise EngineBusy("LLM request queue is full")
+        self._count("submitted")
+        return fut
+
+    def complete(self, prompt: str, timeout: Optional[float] = None, **kwargs) -> Dict[str, Any]:
+        """
+        Blocking completion call: `model(prompt, **kwargs)` on a warm worker.
+        The worker generates with stream=True and checks a stop flag between tokens,
+        so a request that times out frees the worker instead of running to max_tokens.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        stop = threading.Event()
+
+        def run(llm):
+            text, finish_reason = [], None
+            for part in llm(prompt, stream=True, **kwargs):
+                if stop.is_set():
+                    raise EngineTimeout("LLM request stopped after its deadline")
+                choice = part["choices"][0]
+                text.append(choice["text"])
+                finish_reason = choice.get("finish_reason") or finish_reason
+            return {"choices": [{"text": "".join(text), "finish_reason": finish_reason}]}
+
+        fut = self.submit(run, timeout=timeout)
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeout:
+            stop.set()
+            fut.cancel()
+            raise EngineTimeout(f"LLM request did not finish within {timeout:.0f}s")
+
+    def stream(self, prompt: str, timeout: Optional[float] = None, **kwargs) -> Iterator[str]:
+        """
+        Streaming completion: yields text pieces as the model produces them.
+        EngineBusy is raised right away if the queue is full; closing the iterator
+        early (e.g. a guardrail tripped) stops generation on the worker.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        pieces: "queue.Queue" = queue.Queue()
+        stop = threading.Event()
+
+        def run(llm):
+            for part in llm(prompt, stream=True, **kwargs):
+                if stop.is_set():
+                    break
+                pieces.put(part["choices"][0]["text"])
+
+        fut = self.submit(run, timeout=timeout)
+        fut.add_done_callback(lambda _: pieces.put(_DONE))
+        return self._drain(fut, pieces, stop, time.monotonic() + timeout)
+
+    def _drain(self, fut: Future, pieces: "queue.Queue", stop: threading.Event,
+               deadline: float) -> Iterator[str]:
+        try:
+            while True:
+                try:
+                    piece = pieces.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    raise EngineTimeout("LLM stream did not finish in time")
+                if piece is _DONE:
+                    break
+                yield piece
+            if not fut.cancelled():
+                fut.result()  # surface worker-side errors
+        finally:
+            stop.set()
+            fut.cancel()
+
+    def warm(self, timeout: Optional[float] = None) -> int:
+        """
+        Load models ahead of the first real request by queueing one no-op per worker.
+        A fast worker may pick up two of them; returns how many models are loaded.
+        """
+        futs = [self.submit(lambda llm: None, timeout=timeout) for _ in range(self.workers)]
+        for fut in futs:
+            fut.result(timeout=timeout)
+        return self.stats()["models_loaded"]
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            out = dict(self._stats)
+        out["queued"] = self._queue.qsize()
+        out["workers"] = self.workers
+        return out
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+
+def _common_prefix(a, b) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class PrefixCachingModel:
+    """
+    Wraps a llama.cpp model so prompts start from saved KV state instead of
+    re-evaluating a shared prefix.
+    - `warm_prefix` (the fixed system block) is evaluated once at load and saved.
+    - Calls with save_state=True (multi-turn sessions) save the state after the
+      answer, so the next turn, whose prompt extends that text, resumes from it.
+    - Before each call the longest-matching saved state is restored if it covers
+      more of the prompt than what's already in the context; llama.cpp then only
+      evaluates the remaining tokens.
+    - on_prefill(dict) reports prompt_tokens / reused_tokens for the request.
+    Saved states are kept LRU within max_state_bytes.
+    """
+
+    def __init__(self, llm, warm_prefix: str = "", max_state_bytes: int = 1 << 30):
+        self.llm = llm
+        self.max_state_bytes = max_state_bytes
+        self._states: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._pinned = None   # the warm prefix is never evicted
+        self.totals = {"requests": 0, "prompt_tokens": 0, "reused_tokens": 0}
+        if warm_prefix:
+            tokens = self._tokenize(warm_prefix)
+            llm.eval(tokens)
+            self._pinned = tuple(tokens)
+            self._save(self._pinned)
+
+    def _tokenize(self, text: str):
+        # same tokenization llama.cpp applies to a completion prompt
+        return self.llm.tokenize(text.encode("utf-8"), special=True)
+
+    def _save(self, key: tuple):
+        state = self.llm.save_state()
+        self._states[key] = state
+        self._states.move_to_end(key)
+        total = sum(getattr(s, "llama_state_size", 0) for s in self._states.values())
+        for k in list(self._states):
+            if total <= self.max_state_bytes:
+                break
+            if k != self._pinned:
+                total -= getattr(self._states.pop(k), "llama_state_size", 0)
+
+    def _restore_best(self, tokens) -> int:
+        limit = len(tokens) - 1   # llama.cpp always re-evaluates the last prompt token
+        live = min(_common_prefix(self.llm.input_ids[: self.llm.n_tokens], tokens), limit)
+        best_key, best = None, live
+        for key in self._states:
+            n = min(_common_prefix(key, tokens), limit)
+            if n > best:
+                # a longer state is fine: llama.cpp truncates the KV to the matching prefix
+                best_key, best = key, n
+        if best_key is not None:
+            self.llm.load_state(self._states[best_key])
+            self._states.move_to_end(best_key)
+        return best
+
+    def __call__(self, prompt: str, stream: bool = False, save_state: bool = False,
+                 on_prefill: Optional[Callable[[dict], None]] = None, **kwargs):
+        tokens = self._tokenize(prompt)
+        reused = self._restore_best(tokens)
+        info = {"prompt_tokens": len(tokens), "reused_tokens": reused}
+        self.totals["requests"] += 1
+        self.totals["prompt_tokens"] += len(tokens)
+        self.totals["reused_tokens"] += reused
+        if on_prefill:
+            on_prefill(info)
+        out = self.llm(prompt, stream=stream, **kwargs)
+        if not save_state:
+            return out
+        if not stream:
+            self._save(tuple(self.llm.input_ids[: self.llm.n_tokens]))
+            return out
+        return self._save_after(out)
+
+    def _save_after(self, parts):
+        yield from parts
+        self._save(tuple(self.llm.input_ids[: self.llm.n_tokens]))
@@ -0,0 +1,155 @@
+import collections
+import threading
+import time
+from typing import Callable, Deque, List, Optional, Sequence
+
+class _Request:
+    __slots__ = ("items", "enqueued", "done", "result", "error")
+
+    def __init__(self, items: Sequence):
+        self.items = items
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+class MicroBatcher:
+    """
+    Coalesces concurrent calls into fewer, larger `fn(items)` calls.
+    - Callers block in submit(items) while a dispatcher thread collects requests for
+      up to max_wait_ms after the oldest one arrived, or until max_batch items are
+      waiting, then makes one call and hands each caller its slice of the results.
+    - A request is never split across calls; one of max_batch items or more skips
+      the queue and runs directly in the caller's thread (bulk work such as index
+      builds gains nothing from waiting).
+    - fn must return one result per item, in order (a list or an array).
+    metrics() reports batch sizes, queue wait and throughput for capacity planning.
+    """
+
+    def __init__(self, fn: Callable[[List], Sequence], max_batch: int = 32,
+                 max_wait_ms: float = 3.0, name: str = "micro-batcher", window: int = 1024):
+        self.fn = fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait_ms = max_wait_ms
+        self.name = name
+        self._pending: Deque[_Request] = collections.deque()
+        self._pending_items = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._started = time.perf_counter()
+        self._waits: Deque[float] = collections.deque(maxlen=window)   # recent queue waits (ms)
+        self._stats = {"requests": 0, "items": 0, "batches": 0, "batched_items": 0,
+                       "direct_calls": 0, "direct_items": 0, "errors": 0, "busy_s": 0.0}
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def submit(self, items: Sequence):
+        """fn(items) as if called directly, but possibly batched with other callers."""
+        items = list(items)
+        if not items:
+            return self.fn(items)
+        if len(items) >= self.max_batch:
+            start = time.perf_counter()
+            try:
+                return self.fn(items)
+            finally:
+                with self._cond:
+                    self._stats["requests"] += 1
+                    self._stats["items"] += len(items)
+                    self._stats["direct_calls"] += 1
+                    self._stats["direct_items"] += len(items)
+                    self._stats["busy_s"] += time.perf_counter() - start
+        req = _Request(items)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+            self._start()
+            self._pending.append(req)
+            self._pending_items += len(items)
+            self._stats["requests"] += 1
+            self._stats["items"] += len(items)
+            self._cond.notify()
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def _take_batch(self) -> List[_Request]:
+        """Wait for work, then for the batch to fill or the oldest request's deadline."""
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return []
+            deadline = self._pending[0].enqueued + self.max_wait_ms / 1000
+            while self._pending_items < self.max_batch and not self._closed:
+                left = deadline - time.perf_counter()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            batch, n = [], 0
+            while self._pending and (not batch or n + len(self._pending[0].items) <= self.max_batch):
+                req = self._pending.popleft()
+                batch.append(req)
+                n += len(req.items)
+            self._pending_items -= n
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            start = time.perf_counter()
+            items = [x for req in batch for x in req.items]
+            try:
+                results = self.fn(items)
+                pos = 0
+                for req in batch:
+                    req.result = results[pos:pos + len(req.items)]
+                    pos += len(req.items)
+            except BaseException as e:   # every caller in the batch sees the failure
+                for req in batch:
+                    req.error = e
+            end = time.perf_counter()
+            with self._cond:
+                self._stats["batches"] += 1
+                self._stats["batched_items"] += len(items)
+                self._stats["busy_s"] += end - start
+                if batch[0].error is not None:
+                    self._stats["errors"] += 1
+                self._waits.extend((start - req.enqueued) * 1000 for req in batch)
+            for req in batch:
+                req.done.set()
+
+    def metrics(self) -> dict:
+        """
+        Counters since start plus, over the last `window` queued requests, queue wait
+        (ms). items_per_busy_s is encoder throughput while working; items_per_s
+        includes idle time.
+        """
+        with self._cond:
+            s = dict(self._stats)
+            waits = sorted(self._waits)
+            s["queued"] = len(self._pending)
+        uptime = time.perf_counter() - self._started
+        s["mean_batch"] = round(s["batched_items"] / s["batches"], 2) if s["batches"] else 0.0
+        s["items_per_busy_s"] = round(s["items"] / s["busy_s"], 1) if s["busy_s"] else 0.0
+        s["items_per_s"] = round(s["items"] / uptime, 2) if uptime else 0.0
+        s["busy_s"] = round(s["busy_s"], 3)
+        s["wait_ms_mean"] = round(sum(waits) / len(waits), 2) if waits else 0.0
+        s["wait_ms_p95"] = round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 2) if waits else 0.0
+        s["wait_ms_max"] = round(waits[-1], 2) if waits else 0.0
+        return s
+
+    def close(self):
+        """Finish queued requests, then stop the dispatcher thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
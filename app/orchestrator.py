@@ -1,9 +1,72 @@
-from typing import Optional
+import time
+from typing import Callable, Iterator, Optional
 from app.agents.registry import get_registered_agents
-from app.guardrails import pre_answer_guardrails, post_answer_guardrails
-from app.rag_pipeline import retrieve_with_routing, generate_answer
+from app.config import LLM_BUSY_MESSAGE
+from app.guardrails import (
+    classify_query, query_guardrails, retrieval_guardrails, post_answer_guardrails,
+    StreamingAnswerGuard,
+)
+from app.query_cache import AnswerCache
+from app.rag_pipeline import (
+    retrieve_with_routing, generate_answer, embed_queries, index_generation, EngineBusy,
+)
 
-def handle_query(query: str):
+# Answer cache in front of the whole pipeline (FAQ traffic repeats a lot)
+ANSWER_CACHE_SIZE = 512
+ANSWER_CACHE_TTL_S = 600
+SEMANTIC_CACHE_ENABLED = False   # also reuse answers for near-identical paraphrases
+SEMANTIC_CACHE_THRESHOLD = 0.95  # cosine between query embeddings
+
+_answer_cache = AnswerCache(max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL_S)
+_cache_generation = None
+
+def _ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+def _deferred(start: Callable[[], Iterator[str]]) -> Iterator[str]:
+    """Calls start() on the first next(), so nothing is queued on the LLM until consumed."""
+    yield from start()
+
+def _guarded_stream(pieces: Iterator[str], result: dict,
+                    on_done: Optional[Callable[[dict], None]] = None) -> Iterator[str]:
+    """
+    Yield answer text while the post-answer guardrail runs over the growing text.
+    When the stream ends, result["answer"] holds the full text; if the guardrail
+    trips, the stream stops early and result["blocked_msg"] is set instead. If the
+    LLM times out mid-answer, the text so far is kept with result["incomplete"] set.
+    on_done(result) is called once the outcome is known.
+    """
+    guard = StreamingAnswerGuard()
+    start = time.perf_counter()
+    try:
+        try:
+            for piece in pieces:
+                out = guard.feed(piece)
+                if guard.blocked_msg:
+                    break
+                if out:
+                    yield out
+        except EngineBusy:
+            result["incomplete"] = True
+        out = guard.flush()
+        if out:
+            yield out
+    finally:
+        pieces.close()
+    if guard.blocked_msg:
+        result["blocked_msg"] = guard.blocked_msg
+    else:
+        result["answer"] = guard.text.strip()
+    if "timings" in result:
+        result["timings"]["generation_ms"] = _ms(start)
+    if on_done:
+        on_done(result)
+
+def _session_specific(result: dict) -> bool:
+    """An answer the LLM generated (it may build on the session's earlier turns)."""
+    return "prompt" in result and not result.get("blocked_msg")
+
+def handle_query(query: str, stream: bool = False, session_id: Optional[str] = None):
     """
     Returns a dict:
       {
@@ -12,14 +75,113 @@ def handle_query(query: str):
         "route_reason": str,
         "contexts": list[str],
         "scores": list[float],
-        "agent": str | None
+        "sources": list[dict],           # per context: {id, source, dept, start, page}
+        "agent": str | None,
+        "timings": dict[str, float],     # per-stage wall time in ms
+        "prompt": dict,                  # LLM path only: context packing / prompt and reused tokens
+        "incomplete": bool,              # streamed answer cut off by an LLM timeout (not cached)
+        "answer_stream": iterator[str]   # only with stream=True on the LLM path
       }
+    With stream=True, "answer"/"blocked_msg" are filled in once "answer_stream"
+    has been consumed; generation only starts when it is first iterated, so a
+    caller can run retrieval and generation under separate concurrency limits.
+
+    Query-only guardrails run first, so emergency/PII/advice queries never pay for
+    retrieval. Other results are cached per (normalized query, index generation) for
+    ANSWER_CACHE_TTL_S, and the whole cache is dropped when the indexes are rebuilt.
+    With a session_id, LLM answers continue that conversation (and reuse its KV
+    cache), so they bypass the answer cache; agent answers and blocked results
+    don't depend on the conversation and are still cached and served from it.
     """
-    # 1) Retrieve (includes department routing)
-    contexts, scores, route_reason = retrieve_with_routing(query, k_per_dept=3, max_depts=2)
+    timings = {}
 
-    # 2) Global guardrails (emergency, PII, medical advice, low-confidence)
-    allow, blocked_msg = pre_answer_guardrails(query, scores)
+    # 1) Query-only guardrails (emergency, PII, medical advice)
+    t = time.perf_counter()
+    verdict = classify_query(query)  # one engine pass, reused by the retrieval guard
+    allow, blocked_msg = query_guardrails(query, verdict)
+    timings["query_guardrails_ms"] = _ms(t)
+    if not allow:
+        return {
+            "answer": None,
+            "blocked_msg": blocked_msg,
+            "route_reason": "Not routed (blocked before retrieval).",
+            "contexts": [],
+            "scores": [],
+            "sources": [],
+            "agent": None,
+            "timings": timings,
+        }
+
+    # 2) Answer cache
+    global _cache_generation
+    t = time.perf_counter()
+    gen = index_generation()
+    if gen != _cache_generation:
+        _answer_cache.clear()
+        _cache_generation = gen
+
+    cached = _answer_cache.get(query, gen)
+    q_vec = None
+    if cached is None and SEMANTIC_CACHE_ENABLED:
+        q_vec = embed_queries([query])[0]  # reused by retrieval via the embedding cache
+        cached = _answer_cache.get_similar(q_vec, gen, SEMANTIC_CACHE_THRESHOLD)
+    if cached is not None and session_id is not None and _session_specific(cached):
+        cached = None
+    timings["cache_ms"] = _ms(t)
+    if cached is not None:
+        return {**cached, "timings": timings}
+
+    def store(result: dict):
+        if session_id is not None and _session_specific(result):
+            return
+        if result.get("answer") != LLM_BUSY_MESSAGE and not result.get("incomplete"):
+            _answer_cache.put(query, gen, {k: v for k, v in result.items() if k != "answer_stream"}, q_vec)
+
+    result = _answer_query(query, verdict, timings, stream=stream, on_done=store, session_id=session_id)
+    if "answer_stream" not in result:
+        store(result)
+    return result
+
+def _answer_query(query: str, verdict: dict, timings: dict, stream: bool = False,
+                  on_done: Optional[Callable[[dict], None]] = None,
+                  session_id: Optional[str] = None):
+    # 3) An agent with a precomputed answer (e.g. the contact directory) skips
+    # retrieval and the LLM entirely.
+    agents = get_registered_agents()
+    agent = next((a for a in agents if a.can_handle(query)), None)
+    if agent is not None and hasattr(agent, "answer_direct"):
+        t = time.perf_counter()
+        result = agent.answer_direct(query)
+        timings["agent_ms"] = _ms(t)
+        if result is not None:
+            return {
+                "answer": result.get("answer"),
+                "blocked_msg": None,
+                "route_reason": f"Answered by agent '{agent.name}' without retrieval.",
+                "contexts": [],
+                "scores": [],
+                "sources": result.get("sources", []),
+                "agent": agent.name,
+                "timings": timings,
+            }
+
+    # 4) Retrieve (includes department routing). An agent that will take the query
+    # can ask for a cheaper retrieval mode (e.g. contacts: BM25 only, no encoder).
+    mode = getattr(agent, "retrieval", None)
+    t = time.perf_counter()
+    contexts, scores, route_reason, sources = retrieve_with_routing(
+        query, k_per_dept=3, max_depts=2, with_sources=True, mode=mode)
+    timings["retrieval_ms"] = _ms(t)
+
+    # 5) Retrieval-strength guardrail (low-confidence). Lexical hits carry no cosine
+    # score, so an agent that asked for lexical retrieval judges the contexts itself
+    # (the contacts agent abstains with the switchboard when it finds no number).
+    t = time.perf_counter()
+    if mode == "lexical":
+        allow, blocked_msg = True, None
+    else:
+        allow, blocked_msg = retrieval_guardrails(query, scores, verdict)
+    timings["retrieval_guardrails_ms"] = _ms(t)
     if not allow:
         return {
             "answer": None,
@@ -27,13 +189,17 @@ def handle_query(query: str):
             "route_reason": route_reason,
             "contexts": contexts,
             "scores": scores,
+            "sources": sources,
             "agent": None,
+            "timings": timings,
         }
 
-    # 3) Agent selection & execution
-    for agent in get_registered_agents():
+    # 6) Agent selection & execution
+    for agent in agents:
         if agent.can_handle(query):
+            t = time.perf_counter()
             result = agent.run(query, contexts)
+            timings["agent_ms"] = _ms(t)
             if result.get("allowed"):
                 return {
                     "answer": result.get("answer"),
@@ -41,7 +207,9 @@ def handle_query(query: str):
                     "route_reason": route_reason,
                     "contexts": contexts,
                     "scores": scores,
+                    "sources": sources,
                     "agent": agent.name,
+                    "timings": timings,
                 }
             else:
                 # Agent abstained (e.g., no numbers found) -> show its safe fallback
@@ -51,11 +219,36 @@ def handle_query(query: str):
                     "route_reason": route_reason,
                     "contexts": contexts,
                     "scores": scores,
+                    "sources": sources,
                     "agent": agent.name,
+                    "timings": timings,
                 }
 
-    # 4) Fallback to generic RAG generation (with post-answer safety)
-    answer = generate_answer(query, contexts)
+    # 7) Fallback to generic RAG generation (with post-answer safety)
+    prompt_stats = {}   # context packing / prompt token accounting
+    if stream:
+        result = {
+            "answer": None,
+            "blocked_msg": None,
+            "route_reason": route_reason,
+            "contexts": contexts,
+            "scores": scores,
+            "sources": sources,
+            "agent": None,
+            "timings": timings,
+            "prompt": prompt_stats,
+        }
+        result["answer_stream"] = _guarded_stream(
+            _deferred(lambda: generate_answer(query, contexts, stream=True, sources=sources,
+                                              stats=prompt_stats, session_id=session_id)),
+            result, on_done=on_done
+        )
+        return result
+
+    t = time.perf_counter()
+    answer = generate_answer(query, contexts, sources=sources, stats=prompt_stats,
+                             session_id=session_id)
+    timings["generation_ms"] = _ms(t)
     ok, post_msg = post_answer_guardrails(answer)
     if not ok:
         return {
@@ -64,7 +257,10 @@ def handle_query(query: str):
             "route_reason": route_reason,
             "contexts": contexts,
             "scores": scores,
+            "sources": sources,
             "agent": None,
+            "timings": timings,
+            "prompt": prompt_stats,
         }
 
     return {
@@ -73,5 +269,8 @@ def handle_query(query: str):
         "route_reason": route_reason,
         "contexts": contexts,
         "scores": scores,
+        "sources": sources,
         "agent": None,
+        "timings": timings,
+        "prompt": prompt_stats,
     }
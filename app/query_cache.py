@@ -0,0 +1,94 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+_WS = re.compile(r"\s+")
+
+def normalize_query(q: str) -> str:
+    """Cache key for a query: case/whitespace-insensitive, ignoring trailing ?!."""
+    return _WS.sub(" ", q.strip().lower()).rstrip(" ?!.")
+
+class TTLCache:
+    """
+    Small thread-safe LRU cache with an optional time-to-live per entry.
+    - max_entries: least recently used entries are evicted beyond this
+    - ttl: seconds an entry stays valid (None = until evicted)
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl is not None and self.clock() - stored_at > self.ttl
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or self._expired(item[0]):
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (self.clock(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def items(self):
+        """Snapshot of live (key, value) pairs, most recent last."""
+        with self._lock:
+            return [(k, v) for k, (t, v) in self._data.items() if not self._expired(t)]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+class AnswerCache:
+    """
+    (normalized query, index generation) -> handle_query result, with TTL.
+    Entries can carry the query embedding, so a new query whose embedding is within
+    `threshold` cosine of a cached one can reuse its answer (semantic hit).
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 600.0):
+        self._cache = TTLCache(max_entries=max_entries, ttl=ttl)
+
+    def get(self, query: str, generation: int):
+        entry = self._cache.get((normalize_query(query), generation))
+        return None if entry is None else entry[0]
+
+    def get_similar(self, q_vec, generation: int, threshold: float):
+        """Best cached result whose (unit-norm) embedding scores >= threshold against q_vec."""
+        best, best_sim = None, threshold
+        for (_, gen), (result, vec) in self._cache.items():
+            if gen != generation or vec is None:
+                continue
+            sim = float(vec @ q_vec)
+            if sim >= best_sim:
+                best, best_sim = result, sim
+        return best
+
+    def put(self, query: str, generation: int, result: dict, q_vec=None):
+        self._cache.set((normalize_query(query), generation), (result, q_vec))
+
+    def clear(self):
+        self._cache.clear()
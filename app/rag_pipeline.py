@@ -1,27 +1,110 @@
 import os
-from typing import List, Tuple
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 from huggingface_hub import hf_hub_download
 from llama_cpp import Llama
 from router import route_departments
-from embeddings import search_in_dept
-from config import LOW_CONF_FALLBACK
-from guardrails import pre_answer_guardrails
-from config import RETRIEVAL_SIM_THRESHOLD
+from embeddings import embed_queries, search_depts, search_lexical, index_generation, dept_similarities
+from config import LLM_BUSY_MESSAGE
+from llm_engine import LLMEngine, EngineBusy, PrefixCachingModel
+from query_cache import TTLCache
+from reranker import rerank_scores
+from context_packer import approx_tokens, pack_contexts
+
+# embed_queries, index_generation and EngineBusy are re-exported for the orchestrator,
+# so it shares this module's embeddings / LLM engine module instances.
+__all__ = [
+    "ensure_model", "load_llm", "count_tokens", "get_engine", "format_prompt", "prefill_stats",
+    "retrieve_many", "retrieve_with_routing", "generate_answer",
+    "embed_queries", "index_generation", "EngineBusy",
+]
 
 REPO_ID = "TheBloke/Mistral-7B-Instruct-v0.2-GGUF"
 FNAME   = "mistral-7b-instruct-v0.2.Q4_K_M.gguf"
 MODEL_PATH = os.path.join("models", FNAME)
 
+# Shared LLM engine: one warm model per worker, bounded queue for backpressure
+LLM_WORKERS = 1          # each worker holds its own llama.cpp context (~RAM per worker)
+LLM_MAX_QUEUE = 8        # requests waiting beyond this get LLM_BUSY_MESSAGE
+LLM_TIMEOUT_S = 120.0    # queue wait + generation deadline per request
+N_CTX = 4096
+
+# Retrieved text allowed into the prompt (prefill time grows with prompt length);
+# also capped so prompt + max_tokens always fits in N_CTX.
+CONTEXT_TOKEN_BUDGET = 1200
+
+# Retrieval: "dense" (FAISS only), "hybrid" (FAISS + BM25, reciprocal-rank fusion)
+# or "lexical" (BM25 only). Exact tokens like "310-MHSU" or "LifeLabs" need BM25.
+# Dense by default: RETRIEVAL_SIM_THRESHOLD is calibrated for cosine, and in hybrid mode
+# only dense scores count towards the retrieval guardrail until BM25 coverage has its own.
+RETRIEVAL_MODE = "dense"
+RRF_K = 60
+MAX_CONTEXTS = 4           # contexts passed to the prompt without reranking
+
+# Optional cross-encoder rerank: over-fetch, rescore, keep fewer and better contexts
+RERANK_ENABLED = False
+RERANK_CANDIDATES = 12     # merged candidates per question that get rescored
+RERANK_TOP_N = 3           # contexts kept after reranking
+RERANK_BUDGET_MS = 150.0   # per question; over budget -> keep the bi-encoder order
+
+# KV-cache reuse: the system block is prefilled once per worker and restored for each
+# prompt; multi-turn sessions resume from the state saved after their previous answer.
+KV_PREFIX_REUSE = True
+KV_STATE_MAX_BYTES = 1 << 30   # saved llama.cpp states per worker (~0.5 MB per token cached)
+SESSION_TTL_S = 1800           # idle conversations are forgotten after this
+SESSION_MAX_TOKENS = N_CTX // 2   # longer transcripts start over from the system prompt
+
+_engine = None
+_engine_lock = threading.Lock()
+_sessions = TTLCache(max_entries=256, ttl=SESSION_TTL_S)   # session id -> transcript so far
+_prefill_lock = threading.Lock()
+_prefill_totals = {"requests": 0, "prompt_tokens": 0, "reused_tokens": 0}
+
 def ensure_model():
     os.makedirs("models", exist_ok=True)
     if not os.path.exists(MODEL_PATH):
         hf_hub_download(repo_id=REPO_ID, filename=FNAME, local_dir="models")
     return MODEL_PATH
 
-def load_llm(n_ctx=4096, n_threads=8):
+def load_llm(n_ctx=N_CTX, n_threads=8):
     model_path = ensure_model()
     return Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
 
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+def count_tokens(text: str) -> int:
+    """
+    Prompt tokens as the LLM sees them. Uses a vocab-only copy of the model (cheap to
+    load, safe to use outside the engine's worker thread); estimates if unavailable.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                try:
+                    _tokenizer = Llama(model_path=ensure_model(), vocab_only=True, verbose=False)
+                except Exception:
+                    _tokenizer = False
+    if _tokenizer is False:
+        return approx_tokens(text)
+    return len(_tokenizer.tokenize(text.encode("utf-8"), add_bos=False))
+
+def _load_engine_model() -> PrefixCachingModel:
+    return PrefixCachingModel(load_llm(), warm_prefix=PROMPT_PREFIX if KV_PREFIX_REUSE else "",
+                              max_state_bytes=KV_STATE_MAX_BYTES if KV_PREFIX_REUSE else 0)
+
+def get_engine() -> LLMEngine:
+    """Process-wide LLM engine; the model is loaded once and kept warm."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = LLMEngine(_load_engine_model, workers=LLM_WORKERS,
+                                    max_queue=LLM_MAX_QUEUE, timeout=LLM_TIMEOUT_S)
+    return _engine
+
 SYS_PROMPT = (
     "You are a helpful hospital assistant for Royal Inland Hospital (RIH). "
     "Only answer using facts present in the provided CONTEXT. "
@@ -29,12 +112,13 @@ SYS_PROMPT = (
     "Never provide medical advice or interpret personal health information."
 )
 
-def format_prompt(question: str, contexts: List[str]) -> str:
-    joined = "\n\n---\n\n".join(contexts)
-    return f"""[SYSTEM]
-{SYS_PROMPT}
+# Every prompt starts with exactly this text, so its KV state can be computed once.
+PROMPT_PREFIX = f"[SYSTEM]\n{SYS_PROMPT}\n\n"
 
-[CONTEXT]
+def format_prompt(question: str, contexts: List[str], transcript: str = "") -> str:
+    """The prompt for one turn; with a transcript, the turn is appended to the conversation."""
+    joined = "\n\n---\n\n".join(contexts)
+    turn = f"""[CONTEXT]
 {joined}
 
 [USER QUESTION]
@@ -42,47 +126,256 @@ def format_prompt(question: str, contexts: List[str]) -> str:
 
 [ASSISTANT]
 """
+    return f"{transcript}\n\n{turn}" if transcript else PROMPT_PREFIX + turn
 
-def retrieve_with_routing(question: str, k_per_dept: int = 3, max_depts: int = 2) -> Tuple[List[str], List[float], str]:
-    """
-    Route to top departments, search each, then merge results (by score).
-    Fallback to 'global' if routing returns only 'global'.
-    """
-    depts, reason = route_departments(question, top_k=max_depts)
-    pairs = []
-    for d in depts:
-        try:
-            pairs.extend(search_in_dept(question, d, k=k_per_dept))
-        except FileNotFoundError:
-            # index not built for that dept — skip silently
-            continue
-
-    # if nothing meaningful, try global explicitly
-    if not pairs:
-        try:
-            pairs.extend(search_in_dept(question, "global", k=k_per_dept))
-            reason += " | Used global as fallback."
-        except FileNotFoundError:
-            pass
+def prefill_stats() -> dict:
+    """Prompt tokens sent to the LLM vs. tokens served from saved KV state, since start."""
+    with _prefill_lock:
+        out = dict(_prefill_totals)
+    out["reuse_ratio"] = out["reused_tokens"] / out["prompt_tokens"] if out["prompt_tokens"] else 0.0
+    return out
 
-    # sort by score desc and dedupe text
-    pairs = sorted(pairs, key=lambda x: x[1], reverse=True)
+def _merge_hits(hits: List[Tuple[str, float, dict]], limit: int = MAX_CONTEXTS,
+                sort: bool = True) -> Tuple[List[str], List[float], List[dict]]:
+    # sort by score desc (unless already ranked) and dedupe text
+    if sort:
+        hits = sorted(hits, key=lambda x: x[1], reverse=True)
     seen = set()
-    contexts, scores = [], []
-    for c, s in pairs:
+    contexts, scores, sources = [], [], []
+    for c, s, meta in hits:
         if c not in seen:
             contexts.append(c)
             scores.append(s)
+            sources.append(meta)
             seen.add(c)
-        if len(contexts) >= 4:
+        if len(contexts) >= limit:
             break
-    return contexts, scores, reason
-
-def generate_answer(question: str, contexts: List[str], max_tokens=512, temperature=0.1) -> str:
-    prompt = format_prompt(question, contexts)
-    llm = load_llm()
-    out = llm(
-        prompt, max_tokens=max_tokens, temperature=temperature,
-        top_p=0.9, stop=["[USER QUESTION]", "[SYSTEM]"]
-    )
-    return out["choices"][0]["text"].strip()
+    return contexts, scores, sources
+
+def _uncalibrated(hit: Tuple[str, float, dict]) -> Tuple[str, float, dict]:
+    """A BM25 hit with score 0.0; its coverage (not a cosine) moves to meta."""
+    c, coverage, meta = hit
+    return c, 0.0, {**meta, "coverage": round(coverage, 3)}
+
+def _rrf_fuse(ranked_lists: List[List[Tuple[str, float, dict]]]) -> List[Tuple[str, float, dict]]:
+    """
+    Reciprocal-rank fusion of dense and BM25 result lists (by chunk id).
+    Order comes from RRF; each hit's score is its dense cosine, the scale the
+    retrieval guardrail is calibrated for. Hits only BM25 found score 0.0 (their
+    coverage stays in meta), so matching common words like "open" or "weekends"
+    never counts as a strong match.
+    """
+    fused: Dict[int, list] = {}
+    for hits in ranked_lists:
+        for rank, hit in enumerate(hits):
+            c, s, meta = _uncalibrated(hit) if "bm25" in hit[2] else hit
+            entry = fused.get(meta["id"])
+            if entry is None:
+                fused[meta["id"]] = [1.0 / (RRF_K + rank + 1), c, s, dict(meta)]
+            else:
+                entry[0] += 1.0 / (RRF_K + rank + 1)
+                entry[2] = max(entry[2], s)
+                entry[3].update(meta)
+    ranked = sorted(fused.values(), key=lambda e: (e[0], e[2]), reverse=True)
+    return [(c, s, meta) for _, c, s, meta in ranked]
+
+def _search_rows(questions: List[str], q_emb, dept_rows: Dict[str, List[int]],
+                 k: int, mode: str) -> List[List[List[Tuple[str, float, dict]]]]:
+    """Per question row: one ranked hit list per (department, retriever) searched."""
+    lists = [[] for _ in questions]
+    if mode != "lexical":
+        for by_row in search_depts(q_emb, dept_rows, k=k).values():  # unbuilt dept -> skipped
+            for row, found in by_row.items():
+                lists[row].append(found)
+    if mode != "dense":
+        for dept, rows in dept_rows.items():
+            try:
+                found = search_lexical([questions[r] for r in rows], dept, k)
+            except FileNotFoundError:
+                continue
+            for row, hits in zip(rows, found):
+                lists[row].append(hits)
+    return lists
+
+def retrieve_many(questions: List[str], k_per_dept: int = 3, max_depts: int = 2,
+                  with_sources: bool = False, mode: Optional[str] = None) -> List[tuple]:
+    """
+    Batch version of retrieve_with_routing: all questions are encoded in one model
+    call, and each department index is searched once for all the questions routed to it.
+    The same embeddings give the centroid scores used by semantic/hybrid routing.
+    mode (default RETRIEVAL_MODE): "dense", "hybrid" (dense + BM25 via RRF) or
+    "lexical" (BM25 only: no encoder call, keyword routing; scores are 0.0 with the
+    BM25 coverage in the source meta, so the caller has to judge the hits).
+    With RERANK_ENABLED, more candidates are fetched and a cross-encoder picks the
+    final RERANK_TOP_N; scores stay bi-encoder scores for the retrieval guardrail.
+    """
+    mode = mode or RETRIEVAL_MODE
+    limit = RERANK_CANDIDATES if RERANK_ENABLED else MAX_CONTEXTS
+    k_fetch = max(k_per_dept, -(-RERANK_CANDIDATES // max_depts)) if RERANK_ENABLED else k_per_dept
+    if mode == "lexical":
+        q_emb = None
+        routes = [route_departments(q, top_k=max_depts) for q in questions]
+    else:
+        q_emb = embed_queries(questions)
+        sims = dept_similarities(q_emb)
+        routes = [route_departments(q, top_k=max_depts, semantic_scores=sims[row])
+                  for row, q in enumerate(questions)]
+
+    dept_rows = {}
+    for row, (depts, _) in enumerate(routes):
+        for d in depts:
+            dept_rows.setdefault(d, []).append(row)
+    lists = _search_rows(questions, q_emb, dept_rows, k_fetch, mode)
+
+    # if nothing meaningful, try global explicitly (same query vectors)
+    reasons = [reason for _, reason in routes]
+    empty = [row for row, ls in enumerate(lists) if not any(ls)]
+    if empty:
+        fallback = _search_rows(questions, q_emb, {"global": empty}, k_fetch, mode)
+        for row in empty:
+            if any(fallback[row]):
+                lists[row] = fallback[row]
+                reasons[row] += " | Used global as fallback."
+
+    merged = []
+    for row in range(len(questions)):
+        if mode == "hybrid":
+            merged.append(_merge_hits(_rrf_fuse(lists[row]), limit=limit, sort=False))
+        elif mode == "lexical":
+            # ranked by coverage, reported as 0.0 like BM25-only hybrid hits: coverage
+            # isn't on the cosine scale RETRIEVAL_SIM_THRESHOLD is calibrated for
+            hits = sorted((h for hits in lists[row] for h in hits), key=lambda x: x[1], reverse=True)
+            merged.append(_merge_hits([_uncalibrated(h) for h in hits], limit=limit, sort=False))
+        else:
+            merged.append(_merge_hits([h for hits in lists[row] for h in hits], limit=limit))
+    if RERANK_ENABLED:
+        merged = _rerank(questions, merged, reasons)
+
+    results = []
+    for row, (contexts, scores, sources) in enumerate(merged):
+        results.append((contexts, scores, reasons[row], sources) if with_sources
+                       else (contexts, scores, reasons[row]))
+    return results
+
+def _rerank(questions: List[str], merged: List[tuple], reasons: List[str]) -> List[tuple]:
+    """Reorder each question's candidates by cross-encoder score and keep RERANK_TOP_N."""
+    t = time.perf_counter()
+    ce = rerank_scores(questions, [contexts for contexts, _, _ in merged],
+                       RERANK_BUDGET_MS * len(questions))
+    ms = (time.perf_counter() - t) * 1000
+    out = []
+    for row, (contexts, scores, sources) in enumerate(merged):
+        if not contexts:
+            out.append((contexts, scores, sources))
+            continue
+        if ce is None:
+            keep = list(range(min(len(contexts), MAX_CONTEXTS)))
+            reasons[row] += " | Rerank skipped (over budget)."
+        else:
+            keep = sorted(range(len(contexts)), key=lambda i: ce[row][i], reverse=True)[:RERANK_TOP_N]
+            reasons[row] += f" | Reranked {len(contexts)} → {len(keep)} in {ms:.0f} ms."
+            sources = [{**src, "rerank": round(ce[row][i], 3)} for i, src in enumerate(sources)]
+        out.append(([contexts[i] for i in keep], [scores[i] for i in keep], [sources[i] for i in keep]))
+    return out
+
+def retrieve_with_routing(question: str, k_per_dept: int = 3, max_depts: int = 2,
+                          with_sources: bool = False, mode: Optional[str] = None) -> tuple:
+    """
+    Route to top departments, search each, then merge results (by score).
+    Fallback to 'global' if routing returns only 'global'.
+    The question is encoded once and reused for every department searched.
+    Returns (contexts, scores, route_reason), plus one source dict per context
+    ({id, source, dept, start, page}) when with_sources=True.
+    """
+    return retrieve_many([question], k_per_dept=k_per_dept, max_depts=max_depts,
+                         with_sources=with_sources, mode=mode)[0]
+
+def _context_budget(question: str, max_tokens: int, transcript: str = "") -> int:
+    overhead = count_tokens(format_prompt(question, [], transcript))
+    return max(0, min(CONTEXT_TOKEN_BUDGET, N_CTX - max_tokens - overhead))
+
+def _session_transcript(session_id: Optional[str], question: str, max_tokens: int) -> str:
+    """The conversation so far, or "" to start over when it no longer leaves room for context."""
+    transcript = _sessions.get(session_id, "") if session_id else ""
+    if transcript and (count_tokens(transcript) > SESSION_MAX_TOKENS
+                       or _context_budget(question, max_tokens, transcript) < CONTEXT_TOKEN_BUDGET // 2):
+        return ""
+    return transcript
+
+def _record_prefill(info: dict, stats: Optional[dict]):
+    with _prefill_lock:
+        _prefill_totals["requests"] += 1
+        _prefill_totals["prompt_tokens"] += info["prompt_tokens"]
+        _prefill_totals["reused_tokens"] += info["reused_tokens"]
+    if stats is not None:
+        stats["prompt_tokens"] = info["prompt_tokens"]
+        stats["reused_tokens"] = info["reused_tokens"]
+
+def generate_answer(question: str, contexts: List[str], max_tokens=512, temperature=0.1,
+                    stream: bool = False, sources: Optional[List[dict]] = None,
+                    stats: Optional[dict] = None,
+                    session_id: Optional[str] = None) -> Union[str, Iterator[str]]:
+    """
+    Answer from the retrieved contexts. With stream=True, returns an iterator of
+    text pieces as they are generated instead of the final string.
+    Contexts are packed into CONTEXT_TOKEN_BUDGET first (overlaps collapsed, long
+    ones trimmed to relevant sentences); pass `stats` to get the token accounting
+    (prompt_tokens / reused_tokens are exact once the LLM has started the prompt).
+    With a session_id the turn continues that session's conversation, and the
+    LLM resumes from the KV state saved after the previous answer.
+    """
+    transcript = _session_transcript(session_id, question, max_tokens)
+    packed, pack_stats = pack_contexts(question, contexts,
+                                       _context_budget(question, max_tokens, transcript),
+                                       sources=sources, count_tokens=count_tokens)
+    prompt = format_prompt(question, packed, transcript)
+    if stats is not None:
+        stats.update(pack_stats)
+        stats["prompt_tokens"] = count_tokens(prompt)
+    params = dict(max_tokens=max_tokens, temperature=temperature,
+                  top_p=0.9, stop=["[USER QUESTION]", "[SYSTEM]"],
+                  save_state=session_id is not None,
+                  on_prefill=lambda info: _record_prefill(info, stats))
+    on_done = (lambda text: _sessions.set(session_id, prompt + text)) if session_id else None
+    if stream:
+        try:
+            pieces = get_engine().stream(prompt, **params)
+        except EngineBusy:
+            return _stream_answer(iter([LLM_BUSY_MESSAGE]))
+        return _stream_answer(pieces, on_done)
+    try:
+        out = get_engine().complete(prompt, **params)
+    except EngineBusy:
+        return LLM_BUSY_MESSAGE
+    text = out["choices"][0]["text"]
+    if on_done:
+        on_done(text)
+    return text.strip()
+
+def _stream_answer(pieces: Iterator[str], on_done: Optional[Callable[[str], None]] = None) -> Iterator[str]:
+    """
+    Yields the answer pieces; on_done(raw text) runs only if generation ran to the end.
+    EngineBusy before any text becomes LLM_BUSY_MESSAGE; after text has been shown it
+    is re-raised, so the caller knows the answer was cut off.
+    """
+    started = False
+    raw = []
+    try:
+        for piece in pieces:
+            raw.append(piece)
+            if not started:
+                piece = piece.lstrip()   # match the .strip() of the non-streaming path
+                if not piece:
+                    continue
+                started = True
+            yield piece
+        if on_done:
+            on_done("".join(raw))
+    except EngineBusy:
+        if started:
+            raise
+        yield LLM_BUSY_MESSAGE
+    finally:
+        close = getattr(pieces, "close", None)
+        if close:
+            close()
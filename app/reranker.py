@@ -0,0 +1,61 @@
+import threading
+import time
+from typing import List, Optional, Sequence
+from sentence_transformers import CrossEncoder
+
+RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_BATCH_SIZE = 16
+COST_EMA_ALPHA = 0.2   # smoothing of the observed ms-per-pair cost
+
+_model = None
+_model_lock = threading.Lock()
+_ms_per_pair = None    # learned from previous calls; None until the first rerank
+
+def get_reranker() -> CrossEncoder:
+    """Load the cross-encoder once per process and reuse it."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = CrossEncoder(RERANK_MODEL_NAME)
+    return _model
+
+def _observe(ms: float, pairs: int):
+    global _ms_per_pair
+    cost = ms / max(pairs, 1)
+    _ms_per_pair = cost if _ms_per_pair is None else (
+        COST_EMA_ALPHA * cost + (1 - COST_EMA_ALPHA) * _ms_per_pair)
+
+def rerank_scores(queries: Sequence[str], candidates: Sequence[Sequence[str]],
+                  budget_ms: float) -> Optional[List[List[float]]]:
+    """
+    Cross-encoder relevance of every (query, candidate) pair, in batched inference.
+    Returns None (caller keeps the bi-encoder order) when:
+    - the expected cost from previous calls already exceeds budget_ms, or
+    - scoring runs past budget_ms part-way through.
+    """
+    global _ms_per_pair
+    pairs = [(q, c) for q, cands in zip(queries, candidates) for c in cands]
+    if not pairs:
+        return [[] for _ in queries]
+    if _ms_per_pair is not None and _ms_per_pair * len(pairs) > budget_ms:
+        # let the estimate decay while skipping, so a one-off slow call isn't permanent
+        _ms_per_pair *= 1 - COST_EMA_ALPHA
+        return None
+    model = get_reranker()   # load time doesn't count against the budget
+    start = time.perf_counter()
+    scores: List[float] = []
+    for i in range(0, len(pairs), RERANK_BATCH_SIZE):
+        batch = pairs[i:i + RERANK_BATCH_SIZE]
+        scores.extend(float(s) for s in model.predict(batch, batch_size=RERANK_BATCH_SIZE,
+                                                      show_progress_bar=False))
+        elapsed = (time.perf_counter() - start) * 1000
+        if elapsed > budget_ms and len(scores) < len(pairs):
+            _observe(elapsed, len(scores))
+            return None
+    _observe((time.perf_counter() - start) * 1000, len(pairs))
+    out, pos = [], 0
+    for cands in candidates:
+        out.append(scores[pos:pos + len(cands)])
+        pos += len(cands)
+    return out
@@ -1,29 +1,130 @@
 import yaml, re
+import threading
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 from app.slug import slug
 
 CONFIG_PATH = Path("app/dept_config.yaml")
 
-def load_dept_config():
-    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+# Defaults for the optional `routing:` section of dept_config.yaml
+ROUTING_DEFAULTS = {
+    "mode": "keyword",             # keyword | semantic | hybrid
+    "semantic_min_score": 0.25,    # cosine(query, dept centroid) needed to route semantically
+    "keyword_weight": 0.5,         # hybrid: weight of normalised keyword hits vs. cosine
+}
+
+# Words and single punctuation marks, so "x-ray" -> ["x", "-", "ray"]; matching whole
+# tokens gives the same word-boundary behaviour as the old per-keyword \b regexes.
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_END = ""  # trie key holding the keywords that end at a node (never a real token)
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+def load_dept_config(path: Path = CONFIG_PATH):
+    with open(path, "r", encoding="utf-8") as f:
         return yaml.safe_load(f)
 
-def route_departments(query: str, top_k: int = 2) -> Tuple[List[str], str]:
-    cfg = load_dept_config()
-    q = query.lower()
-    scores = []
-    for dept_raw, spec in cfg.get("departments", {}).items():
-        dept_slug = slug(dept_raw)
-        kws = [k.lower() for k in spec.get("keywords", [])]
-        hits = sum(1 for kw in kws if re.search(rf"\b{re.escape(kw)}\b", q))
-        if hits > 0:
-            scores.append((dept_slug, hits, dept_raw))
-    if not scores:
-        fb = slug(cfg.get("fallback", "global"))
-        return [fb], f"No keyword match; falling back to '{fb}'."
-    scores.sort(key=lambda x: x[1], reverse=True)
-    selected_slugs = [d for d, _, _ in scores[:top_k]]
-    human = [r for _, _, r in scores[:top_k]]
-    reason = f"Matched departments: {human} → {selected_slugs}"
-    return selected_slugs, reason
+class DeptRouter:
+    """
+    Keyword router over dept_config.yaml.
+    - The config is parsed once and re-read only when the file's mtime changes.
+    - All keywords of all departments are compiled into one token trie, so a query
+      is scanned once and per-department hit counts come out of that scan.
+    - In "semantic"/"hybrid" mode, route() also takes {dept: cosine} scores of the query
+      embedding against department centroids (computed by the caller, which already
+      has the embedding), so routing adds no model call.
+    """
+
+    def __init__(self, config_path: Path = CONFIG_PATH):
+        self.config_path = Path(config_path)
+        self._lock = threading.Lock()
+        self._mtime = None
+        # ([(slug, raw name) in config order], keyword trie), swapped in as one unit
+        self._compiled: Tuple[List[Tuple[str, str]], dict] = ([], {})
+        self.fallback = "global"
+        self.settings = dict(ROUTING_DEFAULTS)
+
+    def _ensure_loaded(self):
+        mtime = self.config_path.stat().st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime != self._mtime:
+                self._compile(load_dept_config(self.config_path))
+                self._mtime = mtime
+
+    def _compile(self, cfg: dict):
+        depts, trie = [], {}
+        for di, (dept_raw, spec) in enumerate(cfg.get("departments", {}).items()):
+            depts.append((slug(dept_raw), dept_raw))
+            for kw in (spec or {}).get("keywords", []):
+                toks = _tokens(str(kw))
+                if not toks:
+                    continue
+                node = trie
+                for tok in toks:
+                    node = node.setdefault(tok, {})
+                node.setdefault(_END, set()).add((di, " ".join(toks)))
+        self._compiled = (depts, trie)
+        self.fallback = slug(cfg.get("fallback", "global"))
+        self.settings = {**ROUTING_DEFAULTS, **(cfg.get("routing") or {})}
+
+    def keyword_hits(self, query: str) -> Dict[str, int]:
+        """{dept_slug: number of distinct keywords found in the query} (hits > 0 only)."""
+        self._ensure_loaded()
+        depts, trie = self._compiled
+        toks = _tokens(query)
+        matched = set()
+        for i in range(len(toks)):
+            node = trie
+            for j in range(i, len(toks)):
+                node = node.get(toks[j])
+                if node is None:
+                    break
+                if _END in node:
+                    matched |= node[_END]
+        counts: Dict[int, int] = {}
+        for di, _ in matched:
+            counts[di] = counts.get(di, 0) + 1
+        return {depts[di][0]: counts[di] for di in sorted(counts)}
+
+    def route(self, query: str, top_k: int = 2,
+              semantic_scores: Optional[Dict[str, float]] = None) -> Tuple[List[str], str]:
+        hits = self.keyword_hits(query)
+        mode = self.settings["mode"]
+        if mode != "keyword" and semantic_scores:
+            return self._route_scored(hits, semantic_scores, top_k, mode)
+        if not hits:
+            return [self.fallback], f"No keyword match; falling back to '{self.fallback}'."
+        raw = dict(self._compiled[0])
+        scores = sorted(hits.items(), key=lambda x: x[1], reverse=True)[:top_k]
+        selected_slugs = [d for d, _ in scores]
+        human = [raw[d] for d in selected_slugs]
+        reason = f"Matched departments: {human} → {selected_slugs}"
+        return selected_slugs, reason
+
+    def _route_scored(self, hits: Dict[str, int], sims: Dict[str, float],
+                      top_k: int, mode: str) -> Tuple[List[str], str]:
+        min_sim = float(self.settings["semantic_min_score"])
+        w = float(self.settings["keyword_weight"]) if mode == "hybrid" else 0.0
+        # every department with a centroid is scored, listed in the config or not
+        candidates = {d for d, s in sims.items() if s >= min_sim}
+        if mode == "hybrid":
+            candidates |= set(hits)
+        if not candidates:
+            return [self.fallback], f"No {mode} match; falling back to '{self.fallback}'."
+        max_hits = max(hits.values(), default=0) or 1
+        scored = sorted(
+            ((d, w * hits.get(d, 0) / max_hits + (1 - w) * sims.get(d, 0.0)) for d in candidates),
+            key=lambda x: x[1], reverse=True,
+        )[:top_k]
+        selected_slugs = [d for d, _ in scored]
+        detail = ", ".join(f"{d} {s:.2f}" for d, s in scored)
+        return selected_slugs, f"{mode.capitalize()} routing: {detail} → {selected_slugs}"
+
+_router = DeptRouter()
+
+def route_departments(query: str, top_k: int = 2,
+                      semantic_scores: Optional[Dict[str, float]] = None) -> Tuple[List[str], str]:
+    return _router.route(query, top_k=top_k, semantic_scores=semantic_scores)
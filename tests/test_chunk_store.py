@@ -0,0 +1,35 @@
+import pytest
+from app.chunk_store import ChunkStore, MultiChunkStore, write_chunk_store
+
+def _meta(source, dept="laboratory", start=0, page=None):
+    return {"source": source, "dept": dept, "start": start, "page": page}
+
+def test_chunk_store_round_trip_by_id(tmp_path):
+    path = tmp_path / "laboratory.chunks"
+    write_chunk_store(path, [
+        (12, "Lab hours: 7am–3pm.", _meta("laboratory/hours.pdf", start=600, page=2)),
+        (3, "Blood tests need a requisition.", _meta("laboratory/faq.txt")),
+    ])
+    store = ChunkStore(path)
+    assert len(store) == 2 and store.ids() == [3, 12]
+    assert store[12] == "Lab hours: 7am–3pm."
+    assert store.meta(12) == {"id": 12, "source": "laboratory/hours.pdf",
+                              "dept": "laboratory", "start": 600, "page": 2}
+    assert store.meta(3)["page"] is None
+    assert 4 not in store and store.get(4) is None
+    with pytest.raises(KeyError):
+        store[4]
+    assert [r[0] for r in store.records()] == [3, 12]
+
+def test_multi_store_resolves_ids_across_departments(tmp_path):
+    write_chunk_store(tmp_path / "a.chunks", [(1, "one", _meta("a/x.txt", "a"))])
+    write_chunk_store(tmp_path / "b.chunks", [(2, "two", _meta("b/y.txt", "b"))])
+    both = MultiChunkStore([ChunkStore(tmp_path / "a.chunks"), ChunkStore(tmp_path / "b.chunks")])
+    assert both[2] == "two" and both.meta(1)["dept"] == "a"
+    assert 3 not in both
+
+def test_rejects_non_store_files(tmp_path):
+    path = tmp_path / "old.chunks.pkl"
+    path.write_bytes(b"\x80\x04not a chunk store at all")
+    with pytest.raises(ValueError):
+        ChunkStore(path)
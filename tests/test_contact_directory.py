@@ -0,0 +1,73 @@
+from app.contact_directory import (ContactDirectory, build_dept_entries,
+                                   extract_contacts_with_labels, load_directory, save_directory)
+import app.agents.contacts as contacts_mod
+from app.agents.contacts import ContactsAgent
+
+PAGE = """Laboratory Services
+Phone: 250-314-2100
+Book a blood test, call 1 (250) 555-0199 or visit LifeLabs.
+"""
+MH = "Find support. Call 310-MHSU (6478) to reach your local Mental Health & Substance Use centre."
+
+def _directory():
+    return {
+        "laboratory": build_dept_entries("laboratory", [(1, PAGE, {"source": "lab/hours.pdf", "page": 2})]),
+        "mental_health": build_dept_entries("mental_health", [(7, MH, {"source": "mh/intake.txt", "page": None}),
+                                                              (8, MH, {"source": "mh/intake.txt", "page": None})]),
+    }
+
+def test_extracts_numbers_with_labels():
+    found = extract_contacts_with_labels(PAGE + MH)
+    assert ("250-314-2100", "phone", "Laboratory Services") in found
+    assert ("250-555-0199", "phone", "Book a blood test, or visit LifeLabs") in found
+    assert [n for n, kind, _ in found if kind == "helpline"] == ["310-MHSU (6478)"]
+    assert "647-8" not in {n for n, _, _ in found}   # "(6478)" is part of the helpline
+
+def test_entries_dedupe_and_keep_sources(tmp_path):
+    dirs = _directory()
+    assert len(dirs["mental_health"]) == 1   # overlapping chunks repeat the number
+    assert dirs["laboratory"][0]["sources"] == [{"source": "lab/hours.pdf", "page": 2}]
+    save_directory(tmp_path / "contacts.json", dirs)
+    assert load_directory(tmp_path / "contacts.json") == dirs
+
+def test_lookup_by_label_terms_and_department():
+    d = ContactDirectory(_directory())
+    assert [e["number"] for e in d.lookup("number for mental health support?")] == ["310-MHSU (6478)"]
+    assert [e["number"] for e in d.lookup("who do I call to book a blood test")] == ["250-555-0199"]
+    # nothing in the labels: fall back to the routed department's numbers
+    assert d.lookup("who do I call?") == []
+    assert {e["dept"] for e in d.lookup("who do I call?", depts=["laboratory"])} == {"laboratory"}
+
+def test_agent_answers_from_directory_without_contexts(monkeypatch):
+    monkeypatch.setattr(contacts_mod, "get_contact_directory", lambda: ContactDirectory(_directory()))
+    res = ContactsAgent().answer_direct("Who do I call for mental health support?")
+    assert res["allowed"] is True
+    assert "310-MHSU (6478)" in res["answer"]
+    assert res["citations"] == ["mh/intake.txt"]
+
+def test_agent_run_uses_only_the_given_contexts(monkeypatch):
+    monkeypatch.setattr(contacts_mod, "get_contact_directory", lambda: ContactDirectory(_directory()))
+    res = ContactsAgent().run("Who do I call for mental health support?", ["No numbers here."])
+    assert res["allowed"] is False
+
+def test_possessive_labels_dont_match_whats_queries():
+    d = ContactDirectory({
+        **_directory(),
+        "maternity": build_dept_entries("maternity", [(20, "Women's Health Clinic: 250-111-2222",
+                                                       {"source": "mat/clinic.txt", "page": None})]),
+    })
+    numbers = [e["number"] for e in d.lookup("What's the number for the lab?", depts=["laboratory"])]
+    assert "250-111-2222" not in numbers
+    assert numbers and numbers[0] in {"250-314-2100", "250-555-0199"}
+
+def test_number_listed_by_several_departments_is_returned_once():
+    switchboard = "Hospital switchboard: 250-374-5111"
+    d = ContactDirectory({
+        dept: build_dept_entries(dept, [(i, switchboard, {"source": f"{dept}/info.txt", "page": None})])
+        for i, dept in enumerate(["emergency", "laboratory", "visiting"])
+    })
+    entries = d.lookup("hospital switchboard number")
+    assert [e["number"] for e in entries] == ["250-374-5111"]
+    assert [src["source"] for src in entries[0]["sources"]] == [
+        "emergency/info.txt", "laboratory/info.txt", "visiting/info.txt"]
+    assert len(d.lookup("who do I call?", depts=["emergency", "visiting"])) == 1
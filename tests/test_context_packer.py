@@ -0,0 +1,31 @@
+from app.context_packer import collapse_overlaps, pack_contexts, trim_to_budget
+
+DOC = ("Royal Inland Hospital is in Kamloops. Visitor parking is in the parkade on Columbia Street. "
+       "The laboratory opens at 7am on weekdays. Blood tests need a requisition from your provider.")
+
+def words(text):
+    return len(text.split())
+
+def test_collapse_uses_source_offsets():
+    a, b = DOC[:70], DOC[50:140]
+    merged, first = collapse_overlaps([b, a], [{"source": "x.txt", "start": 50},
+                                               {"source": "x.txt", "start": 0}])
+    assert merged == [DOC[:140]] and first == [0]
+
+def test_collapse_falls_back_to_text_overlap_and_drops_duplicates():
+    a, b = DOC[:100], DOC[60:]
+    merged, _ = collapse_overlaps([a, b, DOC[10:40]])
+    assert merged == [DOC]
+
+def test_trim_keeps_relevant_sentences_in_order():
+    out = trim_to_budget(DOC, "When does the laboratory open for blood tests?", 18, words)
+    assert "laboratory opens" in out and "requisition" in out
+    assert "parking" not in out
+
+def test_pack_respects_budget_and_reports_tokens():
+    contexts = [DOC, "Parking costs $3 per hour at the parkade.", "Unrelated filler text " * 20]
+    packed, stats = pack_contexts("laboratory hours", contexts, budget=30, count_tokens=words)
+    assert stats["tokens"] <= 30 and stats["tokens"] == sum(words(p) for p in packed)
+    assert packed[0] == DOC
+    assert stats["contexts_in"] == 3 and stats["contexts_out"] == len(packed)
+    assert stats["dropped"] + stats["contexts_out"] + stats["collapsed"] == 3
@@ -0,0 +1,58 @@
+import gzip
+import sys
+from pathlib import Path
+import pytest
+
+for mod in ("bs4", "pdfminer", "langchain"):
+    pytest.importorskip(mod)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))   # app modules import each other bare
+import data_loader
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_loader, "EXTRACT_CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(data_loader, "EXTRACT_CACHE_ENABLED", True)
+    monkeypatch.setitem(data_loader.PARSER_VERSIONS, "pdf", "test-1")
+    doc = tmp_path / "guide.pdf"
+    doc.write_bytes(b"%PDF fake")
+    calls = []
+    def extract(path):
+        calls.append(path)
+        return f"text of {path.name} #{len(calls)}"
+    return doc, extract, calls
+
+def test_extract_cache_hit_and_miss(cache):
+    doc, extract, calls = cache
+    first = data_loader._cached_extract(doc, "pdf", extract)
+    assert data_loader._cached_extract(doc, "pdf", extract) == first
+    assert len(calls) == 1
+    doc.write_bytes(b"%PDF changed")   # new content hash -> miss
+    assert data_loader._cached_extract(doc, "pdf", extract) != first
+    assert len(calls) == 2
+
+def test_extract_cache_uses_known_hash(cache, monkeypatch):
+    doc, extract, calls = cache
+    sha = data_loader.file_sha256(doc)
+    data_loader._cached_extract(doc, "pdf", extract)
+    def no_rehash(path):
+        raise AssertionError("file hashed again")
+    monkeypatch.setattr(data_loader, "file_sha256", no_rehash)
+    data_loader._cached_extract(doc, "pdf", extract, sha)
+    assert len(calls) == 1
+
+def test_extract_cache_invalidated_by_parser_version(cache, monkeypatch):
+    doc, extract, calls = cache
+    data_loader._cached_extract(doc, "pdf", extract)
+    monkeypatch.setitem(data_loader.PARSER_VERSIONS, "pdf", "test-2")
+    data_loader._cached_extract(doc, "pdf", extract)
+    assert len(calls) == 2
+
+def test_extract_cache_recovers_from_truncated_entry(cache):
+    doc, extract, calls = cache
+    first = data_loader._cached_extract(doc, "pdf", extract)
+    blob, = data_loader.EXTRACT_CACHE_DIR.rglob("*.txt.gz")
+    blob.write_bytes(blob.read_bytes()[:10])
+    again = data_loader._cached_extract(doc, "pdf", extract)
+    assert len(calls) == 2 and again != first
+    with gzip.open(blob, "rt", encoding="utf-8") as f:
+        assert f.read() == again   # rewritten
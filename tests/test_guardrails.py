@@ -3,6 +3,10 @@ from app.guardrails import (
     pre_answer_guardrails,
     post_answer_guardrails,
     extract_contacts,  # if you put it elsewhere, adjust import
+    StreamingAnswerGuard,
+    classify_query,
+    classify_queries,
+    classify_answers,
 )
 from app.config import RETRIEVAL_SIM_THRESHOLD
 
@@ -99,3 +103,46 @@ def test_post_answer_blocks_advice_language():
     txt = "You should take two pills daily."
     ok, post_msg = post_answer_guardrails(txt)
     assert not ok and "medical advice" in post_msg.lower()
+
+def test_streaming_guard_releases_complete_words_only():
+    guard = StreamingAnswerGuard()
+    shown = [guard.feed(p) for p in ["The lab ", "is on the ma", "in floor."]]
+    assert shown[0] == "The lab "
+    assert shown[1] == "is on the "
+    assert shown[2] == "main "
+    assert guard.flush() == "floor."
+    assert guard.blocked_msg is None
+
+def test_streaming_guard_stops_before_advice_reaches_user():
+    guard = StreamingAnswerGuard()
+    shown = "".join(guard.feed(p) for p in ["Visiting is open. You ", "should ", "take ", "two pills "])
+    assert guard.blocked_msg and "medical advice" in guard.blocked_msg.lower()
+    assert "should" not in shown
+    assert guard.flush() == ""
+
+def test_streaming_guard_ignores_advice_words_inside_other_words():
+    guard = StreamingAnswerGuard()
+    out = "".join(guard.feed(p) for p in ["It was a mis", "take in the ", "schedule "]) + guard.flush()
+    assert guard.blocked_msg is None
+    assert out == "It was a mistake in the schedule "
+
+# -----------------------------
+# Compiled guardrail engine
+# -----------------------------
+def test_classify_query_reports_category_and_span():
+    q = "My chest pain started an hour ago"
+    v = classify_query(q)
+    assert v["category"] == "emergency"
+    start, end = v["span"]
+    assert q.lower()[start:end] == "chest pain"
+    assert v["elapsed_ms"] >= 0
+
+def test_classify_query_contact_intent_overrides_advice_patterns():
+    v = classify_query("Who do I call to interpret my lab report?")
+    assert v["category"] is None
+    assert {"medical_advice", "contact_intent"} <= set(v["matches"])
+
+def test_batch_classification_matches_single_calls():
+    texts = ["Where is parking?", "email me at a@b.com", "Do I have the flu?", "You should take two"]
+    assert [v["category"] for v in classify_queries(texts)] == [None, "pii", "medical_advice", None]
+    assert [v["category"] for v in classify_answers(texts)] == [None, None, None, "advice_language"]
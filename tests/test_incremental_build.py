@@ -0,0 +1,155 @@
+import hashlib
+import importlib
+import json
+import sys
+from pathlib import Path
+import pytest
+
+for mod in ("numpy", "faiss", "sentence_transformers", "bs4", "pdfminer", "langchain"):
+    pytest.importorskip(mod)
+import numpy as np
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))   # app modules import each other bare
+
+DIM = 16
+
+class FakeModel:
+    def get_sentence_embedding_dimension(self):
+        return DIM
+
+def fake_encode(chunks):
+    """Deterministic unit vectors per chunk text, so no encoder model is needed."""
+    out = []
+    for c in chunks:
+        seed = int.from_bytes(hashlib.sha256(c.encode()).digest()[:8], "little")
+        v = np.random.default_rng(seed).standard_normal(DIM).astype("float32")
+        out.append(v / np.linalg.norm(v))
+    return np.vstack(out) if out else np.zeros((0, DIM), dtype="float32")
+
+@pytest.fixture
+def encoded():
+    return []   # every chunk text sent to the (fake) encoder
+
+@pytest.fixture
+def emb(tmp_path, monkeypatch, encoded):
+    monkeypatch.chdir(tmp_path)   # index, doc and cache paths are relative to the cwd
+    (tmp_path / "data" / "indexes").mkdir(parents=True)
+    embeddings = importlib.import_module("embeddings")
+    monkeypatch.setattr(embeddings, "get_model", FakeModel)
+    monkeypatch.setattr(embeddings, "_encode_chunks", lambda chunks: encoded.extend(chunks) or fake_encode(chunks))
+    yield embeddings
+    embeddings.clear_index_cache()
+
+def _doc(rel: str, text: str) -> Path:
+    p = Path("data/hospital_docs") / rel
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_text(text)
+    return p
+
+def _build(embeddings, **kw):
+    return embeddings.build_all_indices(workers=1, **kw)
+
+def _stored(embeddings, dept):
+    """{chunk id: (source, text)} as stored for a department; vectors must line up with ids."""
+    vecs, ids, records = embeddings._load_dept_data(dept)
+    assert len(vecs) == len(ids) == len(records)
+    assert sorted(ids.tolist()) == sorted(cid for cid, _, _ in records)
+    return {cid: (meta["source"], text) for cid, text, meta in records}
+
+def _manifest():
+    return json.loads(Path("data/indexes/manifest.json").read_text())
+
+def test_add_change_remove_and_move(emb, encoded):
+    _doc("visiting/hours.txt", "Visiting hours are 8am to 8pm.")
+    _doc("visiting/parking.txt", "Parking is in lot A.")
+    _doc("laboratory/lab.txt", "Lab booking: call 250-555-0001.")
+    s = _build(emb)
+    assert sorted(s["added"]) == ["laboratory/lab.txt", "visiting/hours.txt", "visiting/parking.txt"]
+    assert s["chunks"] == {"global": 3, "visiting": 2, "laboratory": 1}
+
+    encoded.clear()
+    _doc("visiting/parking.txt", "Parking is in lot B.")
+    s = _build(emb)
+    assert s["changed"] == ["visiting/parking.txt"] and s["unchanged"] == 2
+    assert encoded == ["Parking is in lot B."]   # only the changed file is re-embedded
+    texts = {t for _, t in _stored(emb, "visiting").values()}
+    assert texts == {"Visiting hours are 8am to 8pm.", "Parking is in lot B."}
+
+    Path("data/hospital_docs/visiting/hours.txt").unlink()
+    s = _build(emb)
+    assert s["removed"] == ["visiting/hours.txt"]
+    assert [src for src, _ in _stored(emb, "visiting").values()] == ["visiting/parking.txt"]
+
+    # moving a file to another department: removed there, added here
+    Path("data/hospital_docs/laboratory/lab.txt").rename("data/hospital_docs/visiting/lab.txt")
+    s = _build(emb)
+    assert s["removed"] == ["laboratory/lab.txt"] and s["added"] == ["visiting/lab.txt"]
+    assert "laboratory" not in _manifest()["indexes"]
+    assert not Path("data/indexes/laboratory.faiss").exists()
+    assert sorted(src for src, _ in _stored(emb, "visiting").values()) == ["visiting/lab.txt", "visiting/parking.txt"]
+    assert s["chunks"] == {"global": 2, "visiting": 2}
+
+def test_failed_parse_keeps_previous_chunks(emb, monkeypatch):
+    _doc("visiting/parking.txt", "Parking is in lot A.")
+    _build(emb)
+    before = _stored(emb, "visiting")
+
+    real = emb.iter_texts_parallel
+    def failing(files, **kw):
+        for dept, path, text, err in real(files, **kw):
+            yield dept, path, None, "PDFSyntaxError: broken"
+    monkeypatch.setattr(emb, "iter_texts_parallel", failing)
+    _doc("visiting/parking.txt", "Parking is in lot B.")
+    s = _build(emb)
+    assert s["errors"] == {"visiting/parking.txt": "PDFSyntaxError: broken"}
+    assert _stored(emb, "visiting") == before
+
+    monkeypatch.setattr(emb, "iter_texts_parallel", real)   # retried, and fixed, next build
+    s = _build(emb)
+    assert s["changed"] == ["visiting/parking.txt"]
+    assert {t for _, t in _stored(emb, "visiting").values()} == {"Parking is in lot B."}
+
+def test_chunk_ids_not_reused_after_deletion(emb):
+    _doc("visiting/a.txt", "First document.")
+    _doc("visiting/b.txt", "Second document.")
+    _build(emb)
+    issued = set(_stored(emb, "visiting"))
+    Path("data/hospital_docs/visiting/b.txt").unlink()
+    _build(emb)
+    _doc("visiting/c.txt", "Third document.")
+    _build(emb)
+    new_ids = {cid for cid, (src, _) in _stored(emb, "visiting").items() if src == "visiting/c.txt"}
+    assert new_ids and not new_ids & issued
+    assert _manifest()["next_id"] > max(new_ids)
+
+def test_settings_change_forces_full_rebuild(emb, encoded, monkeypatch):
+    _doc("visiting/a.txt", "First document.")
+    _doc("laboratory/b.txt", "Second document.")
+    _build(emb)
+    encoded.clear()
+    assert _build(emb)["added"] == [] and encoded == []
+
+    monkeypatch.setattr(emb, "EMB_MODEL_PATH", "models/other-encoder")
+    s = _build(emb)
+    assert sorted(s["added"]) == ["laboratory/b.txt", "visiting/a.txt"]
+    assert sorted(encoded) == ["First document.", "Second document."]
+    assert _manifest()["settings"]["model"] == "models/other-encoder"
+
+def test_recovers_from_a_build_that_failed_partway(emb, monkeypatch):
+    _doc("visiting/a.txt", "First document.")
+    _doc("laboratory/b.txt", "Second document.")
+    _build(emb)
+    _doc("visiting/c.txt", "Third document.")
+    _doc("laboratory/d.txt", "Fourth document.")
+    real, calls = emb._write_dept, []
+    def crash_on_second(dept, *args, **kw):
+        calls.append(dept)
+        if len(calls) == 2:
+            raise RuntimeError("disk full")
+        return real(dept, *args, **kw)
+    monkeypatch.setattr(emb, "_write_dept", crash_on_second)
+    with pytest.raises(RuntimeError):
+        _build(emb)   # one department written, manifest not updated
+    monkeypatch.setattr(emb, "_write_dept", real)
+    s = _build(emb)
+    assert s["chunks"] == {"global": 4, "visiting": 2, "laboratory": 2}
+    assert _build(emb)["added"] == []
@@ -0,0 +1,37 @@
+from app.lexical import BM25Index, tokenize
+
+DOCS = [
+    (10, "Mental health and substance use: call 310-MHSU (6478) for your local centre."),
+    (11, "LifeLabs patient service centre hours are 7:00 to 15:00 on weekdays."),
+    (12, "Visitor parking is available in the parkade off Columbia Street."),
+]
+
+def test_tokenize_keeps_compounds_and_their_parts():
+    toks = tokenize("Call 310-MHSU or 250-374-5111")
+    assert "310-mhsu" in toks and "mhsu" in toks
+    assert "250-374-5111" in toks and "5111" in toks
+    assert "or" not in toks
+
+def test_tokenize_drops_one_letter_parts():
+    assert "s" not in tokenize("What's on at Women's Health?")
+    assert "x" not in tokenize("x-ray") and "ray" in tokenize("x-ray")
+
+def test_exact_tokens_rank_first_with_full_coverage():
+    index = BM25Index.build(DOCS)
+    hits = index.search("LifeLabs", k=2)
+    assert hits[0][0] == 11 and hits[0][2] == 1.0
+    assert index.search("310-MHSU number")[0][0] == 10
+
+def test_unknown_terms_lower_coverage():
+    index = BM25Index.build(DOCS)
+    (cid, _, coverage), = index.search("parking for helicopters", k=1)
+    assert cid == 12 and 0 < coverage < 1
+    assert index.search("helicopters") == []
+
+def test_merge_matches_single_index(tmp_path):
+    whole = BM25Index.build(DOCS)
+    merged = BM25Index.merge([BM25Index.build(DOCS[:1]), BM25Index.build(DOCS[1:])])
+    merged.save(tmp_path / "g.bm25")
+    loaded = BM25Index.load(tmp_path / "g.bm25")
+    for q in ("centre hours", "310-MHSU", "parking street"):
+        assert loaded.search(q, k=3) == whole.search(q, k=3)
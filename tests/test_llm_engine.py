@@ -0,0 +1,115 @@
+import threading
+import time
+import pytest
+from app.llm_engine import LLMEngine, EngineBusy, EngineTimeout, PrefixCachingModel
+
+class FakeLLM:
+    def __init__(self, gate=None):
+        self.gate = gate
+    def __call__(self, prompt, stream=False, **kwargs):
+        if self.gate is not None:
+            self.gate.wait()
+        if stream:
+            return iter([{"choices": [{"text": "echo: "}]}, {"choices": [{"text": prompt}]}])
+        return {"choices": [{"text": f"echo: {prompt}"}]}
+
+def test_engine_loads_model_once_and_reuses_it():
+    loads = []
+    def loader():
+        loads.append(1)
+        return FakeLLM()
+    engine = LLMEngine(loader, workers=1, max_queue=4, timeout=5)
+    for i in range(3):
+        out = engine.complete(f"q{i}")
+        assert out["choices"][0]["text"] == f"echo: q{i}"
+    assert len(loads) == 1
+    engine.shutdown()
+
+def test_engine_warm_loads_before_first_request():
+    engine = LLMEngine(FakeLLM, workers=1, max_queue=4, timeout=5)
+    assert engine.stats()["models_loaded"] == 0
+    assert engine.warm() == 1
+    engine.complete("q")
+    assert engine.stats()["models_loaded"] == 1
+    engine.shutdown()
+
+def test_engine_rejects_when_queue_full():
+    gate = threading.Event()
+    engine = LLMEngine(lambda: FakeLLM(gate), workers=1, max_queue=1, timeout=5)
+    running = engine.submit(lambda llm: llm("a"))   # picked up by the worker, blocks on gate
+    while engine.stats()["queued"]:
+        pass
+    engine.submit(lambda llm: llm("b"))             # fills the queue
+    with pytest.raises(EngineBusy):
+        engine.submit(lambda llm: llm("c"))
+    gate.set()
+    assert running.result(timeout=5)["choices"][0]["text"] == "echo: a"
+    engine.shutdown()
+
+def test_engine_times_out():
+    gate = threading.Event()
+    engine = LLMEngine(lambda: FakeLLM(gate), workers=1, max_queue=2, timeout=0.05)
+    with pytest.raises(EngineTimeout):
+        engine.complete("slow")
+    gate.set()
+    engine.shutdown()
+
+def test_engine_timeout_stops_generation_on_the_worker():
+    produced = []
+    class SlowLLM:
+        def __call__(self, prompt, stream=False, **kwargs):
+            for i in range(200):
+                time.sleep(0.01)
+                produced.append(i)
+                yield {"choices": [{"text": "x"}]}
+    engine = LLMEngine(SlowLLM, workers=1, max_queue=2, timeout=0.05)
+    with pytest.raises(EngineTimeout):
+        engine.complete("long answer")
+    engine.shutdown()   # returns once the worker has dropped the timed-out request
+    assert len(produced) < 50
+    assert engine.stats()["failed"] == 1
+
+class FakeStateLLM:
+    """Mimics the llama.cpp prefix handling: KV = input_ids[:n_tokens]."""
+    def __init__(self):
+        self.input_ids, self.n_tokens, self.evaluated = [], 0, 0
+    def tokenize(self, text, add_bos=True, special=False):
+        return [1] + [ord(c) for c in text.decode()]
+    def eval(self, tokens):
+        self.input_ids = self.input_ids[: self.n_tokens] + list(tokens)
+        self.n_tokens = len(self.input_ids)
+        self.evaluated += len(tokens)
+    def save_state(self):
+        return (list(self.input_ids), self.n_tokens)
+    def load_state(self, state):
+        self.input_ids, self.n_tokens = list(state[0]), state[1]
+    def __call__(self, prompt, stream=False, **kwargs):
+        tokens = self.tokenize(prompt.encode())
+        keep = 0
+        for a, b in zip(self.input_ids[: self.n_tokens], tokens[:-1]):
+            if a != b:
+                break
+            keep += 1
+        self.n_tokens = keep
+        self.eval(tokens[keep:] + [ord(c) for c in "ok"])
+        return {"choices": [{"text": "ok"}]}
+
+def test_prefix_model_reuses_warm_system_prefix():
+    llm = FakeStateLLM()
+    model = PrefixCachingModel(llm, warm_prefix="[SYSTEM] be nice\n")
+    seen = []
+    model("[SYSTEM] be nice\nQ: parking?", on_prefill=seen.append)
+    llm.load_state(([], 0))   # context clobbered, e.g. by an unrelated prompt
+    model("[SYSTEM] be nice\nQ: lab hours?", on_prefill=seen.append)
+    assert [s["reused_tokens"] for s in seen] == [18, 18]   # BOS + the system block
+    assert model.totals["requests"] == 2
+
+def test_prefix_model_resumes_saved_conversation():
+    llm = FakeStateLLM()
+    model = PrefixCachingModel(llm, warm_prefix="[SYSTEM]\n")
+    turn1 = "[SYSTEM]\nQ: parking?\nA: "
+    model(turn1, save_state=True)
+    model("[SYSTEM]\nQ: something else entirely")
+    seen = []
+    model(turn1 + "ok\nQ: and the cost?\nA: ", on_prefill=seen.append)
+    assert seen[0]["reused_tokens"] == len(turn1) + 1 + 2   # BOS + turn 1 + its answer
@@ -0,0 +1,42 @@
+import threading
+import pytest
+from app.micro_batcher import MicroBatcher
+
+def test_concurrent_calls_share_one_batch():
+    calls = []
+    def fn(items):
+        calls.append(list(items))
+        return [x * 2 for x in items]
+    batcher = MicroBatcher(fn, max_batch=8, max_wait_ms=200)
+    results = {}
+    def worker(i):
+        results[i] = batcher.submit([i, i + 100])
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == {i: [2 * i, 2 * (i + 100)] for i in range(4)}
+    assert len(calls) == 1 and len(calls[0]) == 8   # full batch: sent without waiting out max_wait
+    m = batcher.metrics()
+    assert m["batches"] == 1 and m["requests"] == 4 and m["mean_batch"] == 8
+    batcher.close()
+
+def test_large_requests_bypass_the_queue():
+    threads_seen = []
+    def fn(items):
+        threads_seen.append(threading.current_thread().name)
+        return list(items)
+    batcher = MicroBatcher(fn, max_batch=4, max_wait_ms=1000)
+    assert batcher.submit(range(10)) == list(range(10))
+    assert threads_seen == [threading.current_thread().name]
+    assert batcher.metrics()["direct_calls"] == 1
+
+def test_errors_reach_every_caller_in_the_batch():
+    def fn(items):
+        raise ValueError("encoder failed")
+    batcher = MicroBatcher(fn, max_batch=4, max_wait_ms=1)
+    with pytest.raises(ValueError):
+        batcher.submit(["a"])
+    assert batcher.metrics()["errors"] == 1
+    batcher.close()
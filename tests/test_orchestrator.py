@@ -0,0 +1,57 @@
+import sys
+from pathlib import Path
+import pytest
+
+for mod in ("numpy", "faiss", "sentence_transformers", "huggingface_hub", "llama_cpp"):
+    pytest.importorskip(mod)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))   # app modules import each other bare
+import app.orchestrator as orchestrator
+from app.config import EMERGENCY_MESSAGE
+
+def _no_retrieval(*args, **kwargs):
+    raise AssertionError("retrieval must not run")
+
+@pytest.mark.parametrize("query", [
+    "I have severe chest pain and can't breathe.",
+    "My name is John, MRN 12345, phone 604-555-0199. What should I do?",
+])
+def test_query_guardrails_return_before_retrieval(monkeypatch, query):
+    monkeypatch.setattr(orchestrator, "retrieve_with_routing", _no_retrieval)
+    monkeypatch.setattr(orchestrator, "generate_answer", _no_retrieval)
+    res = orchestrator.handle_query(query)
+    assert res["answer"] is None and res["blocked_msg"]
+    assert res["contexts"] == [] and res["sources"] == []
+    assert set(res["timings"]) == {"query_guardrails_ms"}
+
+def test_emergency_message_is_returned(monkeypatch):
+    monkeypatch.setattr(orchestrator, "retrieve_with_routing", _no_retrieval)
+    res = orchestrator.handle_query("I have severe chest pain and can't breathe.")
+    assert res["blocked_msg"] == EMERGENCY_MESSAGE
+
+def test_timings_cover_each_stage(monkeypatch):
+    monkeypatch.setattr(orchestrator, "index_generation", lambda: 1)
+    monkeypatch.setattr(orchestrator, "retrieve_with_routing",
+                        lambda q, **kw: (["Parking is in lot A."] * 2, [0.8, 0.7], "routed", [{}, {}]))
+    monkeypatch.setattr(orchestrator, "generate_answer", lambda q, contexts, **kw: "Parking is in lot A.")
+    orchestrator._answer_cache.clear()
+    res = orchestrator.handle_query("Where do visitors park at the hospital?")
+    assert res["answer"] == "Parking is in lot A."
+    assert {"query_guardrails_ms", "cache_ms", "retrieval_ms", "retrieval_guardrails_ms",
+            "generation_ms"} <= set(res["timings"])
+
+def test_answer_cache_cleared_when_index_generation_changes(monkeypatch):
+    gen, calls = [1], []
+    monkeypatch.setattr(orchestrator, "index_generation", lambda: gen[0])
+    monkeypatch.setattr(orchestrator, "retrieve_with_routing",
+                        lambda q, **kw: (["Parking is in lot A."] * 2, [0.8, 0.7], "routed", [{}, {}]))
+    def answer(q, contexts, **kw):
+        calls.append(q)
+        return f"answer {len(calls)}"
+    monkeypatch.setattr(orchestrator, "generate_answer", answer)
+    orchestrator._answer_cache.clear()
+    q = "Where do visitors park at the hospital?"
+    assert orchestrator.handle_query(q)["answer"] == "answer 1"
+    assert orchestrator.handle_query(q)["answer"] == "answer 1"   # served from the cache
+    gen[0] = 2   # indexes rebuilt
+    assert orchestrator.handle_query(q)["answer"] == "answer 2"
+    assert len(calls) == 2
@@ -0,0 +1,35 @@
+from app.query_cache import AnswerCache, TTLCache, normalize_query
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+def test_normalize_query_ignores_case_spacing_and_trailing_punctuation():
+    assert normalize_query("  Where is   PARKING? ") == normalize_query("where is parking")
+
+def test_ttl_cache_expires_entries():
+    clock = FakeClock()
+    cache = TTLCache(max_entries=4, ttl=10, clock=clock)
+    cache.set("a", 1)
+    clock.now = 5
+    assert cache.get("a") == 1
+    clock.now = 16
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")          # "b" is now the oldest
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+def test_answer_cache_is_keyed_by_index_generation():
+    cache = AnswerCache()
+    cache.put("Visiting hours?", 1, {"answer": "9-5"})
+    assert cache.get("visiting hours", 1) == {"answer": "9-5"}
+    assert cache.get("visiting hours", 2) is None
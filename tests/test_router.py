@@ -1,4 +1,4 @@
-from app.router import route_departments
+from app.router import DeptRouter, route_departments
 from app.slug import slug
 
 def test_router_mental_health_keywords():
@@ -10,3 +10,59 @@ def test_router_fallback_global():
     q = "completely unrelated text"
     depts, reason = route_departments(q, top_k=2)
     assert depts and depts[0] in {"global", slug("global")}, reason
+
+def test_router_counts_multiword_keywords_once_per_keyword():
+    q = "Do I need to book a blood test at the lab? Is the lab open for a blood test?"
+    depts, reason = route_departments(q, top_k=1)
+    assert depts == ["laboratory"], reason
+
+def test_router_respects_word_boundaries():
+    # "er" must not match inside "over" / "there"
+    depts, _ = route_departments("is there parking over here", top_k=2)
+    assert depts == ["visiting"]
+
+def test_router_reloads_config_when_file_changes(tmp_path):
+    import os
+    cfg = tmp_path / "dept_config.yaml"
+    cfg.write_text('departments:\n  pharmacy:\n    keywords: ["pharmacy"]\nfallback: "global"\n')
+    router = DeptRouter(cfg)
+    assert router.route("where is the pharmacy")[0] == ["pharmacy"]
+    assert router.route("where is the cafeteria")[0] == ["global"]
+
+    cfg.write_text('departments:\n  food services:\n    keywords: ["cafeteria"]\nfallback: "global"\n')
+    st = cfg.stat()
+    os.utime(cfg, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    assert router.route("where is the cafeteria")[0] == ["food_services"]
+
+def _write_routing_config(tmp_path, mode):
+    cfg = tmp_path / "dept_config.yaml"
+    cfg.write_text(
+        'departments:\n'
+        '  laboratory:\n    keywords: ["lab", "blood test"]\n'
+        '  visiting:\n    keywords: ["parking"]\n'
+        'fallback: "global"\n'
+        f'routing:\n  mode: "{mode}"\n  semantic_min_score: 0.3\n  keyword_weight: 0.5\n'
+    )
+    return DeptRouter(cfg)
+
+def test_semantic_mode_uses_centroid_scores(tmp_path):
+    router = _write_routing_config(tmp_path, "semantic")
+    depts, reason = router.route("where do I get bloodwork", semantic_scores={"laboratory": 0.62, "visiting": 0.1})
+    assert depts == ["laboratory"], reason
+    depts, _ = router.route("where do I get bloodwork", semantic_scores={"laboratory": 0.2, "visiting": 0.1})
+    assert depts == ["global"]
+
+def test_hybrid_mode_combines_keywords_and_similarity(tmp_path):
+    router = _write_routing_config(tmp_path, "hybrid")
+    depts, reason = router.route("parking near the lab", top_k=2,
+                                 semantic_scores={"laboratory": 0.7, "visiting": 0.2})
+    assert depts == ["laboratory", "visiting"], reason
+
+def test_semantic_mode_without_scores_falls_back_to_keywords(tmp_path):
+    router = _write_routing_config(tmp_path, "hybrid")
+    assert router.route("parking please")[0] == ["visiting"]
+
+def test_semantic_mode_scores_departments_missing_from_config(tmp_path):
+    router = _write_routing_config(tmp_path, "semantic")
+    depts, reason = router.route("where do I pay my bill", semantic_scores={"billing": 0.55, "visiting": 0.1})
+    assert depts == ["billing"], reason
@@ -0,0 +1,86 @@
+import sys
+from pathlib import Path
+import pytest
+
+for mod in ("numpy", "faiss", "sentence_transformers", "bs4", "pdfminer", "langchain"):
+    pytest.importorskip(mod)
+import numpy as np
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))   # app modules import each other bare
+
+N, DIM = 2000, 32
+
+@pytest.fixture(scope="module")
+def emb(tmp_path_factory):
+    mp = pytest.MonkeyPatch()
+    mp.chdir(tmp_path_factory.mktemp("idx"))   # embeddings creates data/indexes on import
+    import embeddings
+    mp.undo()
+    return embeddings
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    vecs = rng.standard_normal((N, DIM)).astype("float32")
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    ids = np.arange(N, dtype="int64") * 3 + 7   # ids are not row numbers
+    queries = vecs[:100] + 0.05 * rng.standard_normal((100, DIM)).astype("float32")
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = ids[np.argmax(queries @ vecs.T, axis=1)]
+    return vecs, ids, queries, truth
+
+def _exact(emb, tmp_path, vecs, ids):
+    np.save(tmp_path / "d.vecs.npy", vecs)
+    np.save(tmp_path / "d.ids.npy", ids)
+    return emb.ExactVectors(tmp_path / "d.vecs.npy", tmp_path / "d.ids.npy")
+
+def test_rescore_orders_candidates_by_exact_cosine(emb, tmp_path):
+    rng = np.random.default_rng(1)
+    vecs = rng.standard_normal((50, 8)).astype("float32")
+    ids = rng.permutation(np.arange(100, 150)).astype("int64")   # unsorted ids
+    exact = _exact(emb, tmp_path, vecs, ids)
+    q = rng.standard_normal((2, 8)).astype("float32")
+    cand = np.array([ids[:10].tolist() + [-1, 999], ids[20:32].tolist()], dtype="int64")
+    D, I = exact.rescore(q, cand, k=5)
+    for r in range(2):
+        known = [c for c in cand[r] if c in ids]
+        scores = {c: float(vecs[ids.tolist().index(c)] @ q[r]) for c in known}
+        best = sorted(known, key=scores.get, reverse=True)[:5]
+        assert I[r].tolist() == best
+        assert np.allclose(D[r], [scores[c] for c in best], atol=1e-5)
+
+def test_rescore_pads_rows_without_candidates(emb, tmp_path):
+    exact = _exact(emb, tmp_path, np.eye(4, dtype="float32"), np.arange(4, dtype="int64"))
+    D, I = exact.rescore(np.ones((1, 4), dtype="float32"), np.array([[2, -1, 42]]), k=3)
+    assert I.tolist() == [[2, -1, -1]] and D[0, 0] == 1.0 and np.isneginf(D[0, 1:]).all()
+
+def test_factory_string_fallbacks(emb):
+    assert emb._index_factory_string("ivf_flat", 50, DIM) == "IDMap,Flat"   # too few to train IVF
+    assert emb._index_factory_string("flat", 50, DIM, "pq") == "IDMap,SQ8"  # too few for PQ codebooks
+    assert emb._index_factory_string("hnsw", N, DIM, "fp16") == f"IDMap,HNSW{emb.HNSW_M}_SQfp16"
+    with pytest.raises(ValueError):
+        emb._index_factory_string("annoy", N, DIM)
+    with pytest.raises(ValueError):
+        emb._index_factory_string("flat", N, DIM, "int4")
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw", "ivf_flat", "ivf_pq"])
+@pytest.mark.parametrize("codec", ["fp32", "fp16", "sq8", "pq"])
+def test_index_types_and_codecs_build_and_recall(emb, data, tmp_path, kind, codec):
+    # at this size PQ falls back to SQ8 (too few training points); see the test below
+    _check_recall(emb, data, tmp_path, emb._index_factory_string(kind, N, DIM, codec))
+
+def test_pq_codes_recall_after_rescoring(emb, data, tmp_path, monkeypatch):
+    monkeypatch.setattr(emb, "PQ_MIN_VECTORS", 256)   # train real PQ codebooks on the small set
+    spec = emb._index_factory_string("flat", N, DIM, "pq")
+    assert spec == f"IDMap,PQ{DIM // emb.PQ_DIMS_PER_CODE}"
+    _check_recall(emb, data, tmp_path, spec)
+
+def _check_recall(emb, data, tmp_path, spec):
+    vecs, ids, queries, truth = data
+    index = emb._build_index(spec, vecs, ids)
+    assert index.ntotal == N
+    k = 4 * emb.RESCORE_FACTOR
+    _, I = index.search(queries, k)
+    assert np.mean(I[:, 0] == truth) >= (1.0 if spec in ("IDMap,Flat", f"IDMap,HNSW{emb.HNSW_M}") else 0.9)
+    if emb._is_lossy(index):
+        _, I = _exact(emb, tmp_path, vecs, ids).rescore(queries, I, k=1)
+    assert np.mean(I[:, 0] == truth) >= 0.98